@@ -0,0 +1,105 @@
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+from cache import POLICIES, get_result_cache
+from db import current_run
+from dimensions import get_dimension_registry
+from profiling import boot_stats, current_profile, pool_stats
+
+QUERY_COLUMNS = ["fetch", "source", "wall_ms", "db_ms", "pool_wait_ms", "rows", "bytes", "sql", "plan"]
+
+
+def is_admin():
+    # The admin panels are hidden unless the page is opened with
+    # ?admin=<WEBSHOP_ADMIN_TOKEN>
+    token = os.environ.get("WEBSHOP_ADMIN_TOKEN")
+    return bool(token) and st.query_params.get("admin") == token
+
+
+def cache_panel():
+    cache = get_result_cache()
+    entries = cache.entries()
+    now = time.time()
+
+    st.write(
+        f"{cache.nbytes / 2**20:.1f} MB of {cache.max_bytes / 2**20:.0f} MB used "
+        f"by {len(entries)} results"
+    )
+    labels = {
+        f"{entry.name}{dict(entry.args) if entry.args else ''}": key
+        for key, entry in entries
+    }
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "result": label,
+                    "policy": entry.policy,
+                    "MB": round(entry.nbytes / 2**20, 2),
+                    "age (s)": int(now - entry.created),
+                    "expires in (s)": int(entry.expires - now),
+                }
+                for label, (_, entry) in zip(labels, entries)
+            ]
+        ),
+        hide_index=True,
+    )
+
+    policies = st.multiselect("Invalidate policies", list(POLICIES))
+    selected = st.multiselect("Invalidate results", list(labels))
+    if st.button("Invalidate selected"):
+        cache.invalidate(
+            [labels[label] for label in selected]
+            + [key for key, entry in entries if entry.policy in policies]
+        )
+        st.rerun()
+    if st.button("Invalidate all"):
+        cache.invalidate()
+        get_dimension_registry().invalidate()
+        st.rerun()
+
+
+def profile_panel():
+    # What this run cost: cached fetch calls, the queries behind them and the
+    # time spent rendering each section
+    profile = current_profile()
+    # Kept outside widget state, which is dropped on runs that stop (e.g. an
+    # invalidation rerun) before this panel is drawn
+    st.session_state["profile_explain"] = st.checkbox(
+        "Capture EXPLAIN ANALYZE",
+        value=st.session_state.get("profile_explain", False),
+        help="From the next run on; only queries that miss the result cache are explained",
+    )
+    pools = pool_stats()
+    if pools:
+        st.write("Connection pools")
+        st.dataframe(pd.DataFrame(pools), hide_index=True)
+    boot = boot_stats()
+    if boot:
+        st.write("Boot")
+        st.dataframe(pd.DataFrame(boot), hide_index=True)
+    if profile is None:
+        return
+
+    run = current_run()
+    if run is not None:
+        st.caption(f"{run.sent} queries issued, {run.saved} round trips saved this run")
+    st.write("Sections")
+    st.dataframe(pd.DataFrame(profile.sections), hide_index=True)
+    st.write("Fetch calls")
+    st.dataframe(pd.DataFrame(profile.fetches), hide_index=True)
+    st.write("Queries")
+    queries = pd.DataFrame(profile.queries, columns=QUERY_COLUMNS)
+    st.dataframe(queries.drop(columns="plan"), hide_index=True)
+
+    for query in profile.queries:
+        if query.get("plan") is not None:
+            with st.popover(f"Plan: {query['fetch'] or query['sql'][:40]}"):
+                st.code(query["sql"], language="sql")
+                if isinstance(query["plan"], str):
+                    st.text(query["plan"])
+                else:
+                    st.json(query["plan"], expanded=False)
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import statistics
+import time
+
+import pandas as pd
+import sqlalchemy
+import streamlit as st
+from sqlalchemy import text
+
+from db import database_url, get_connection
+from explain import estimate_rows, sql_fetches
+from synthetic import generate, parse_scale
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+SECTIONS = ["Categories", "Pricing", "Customers", "Stock"]
+# Seconds a single script run may take before the benchmark gives up
+RUN_TIMEOUT = 30 * 60
+
+
+class TimingConnection:
+    # Sends every query straight to the database and keeps its timings
+    def __init__(self, engine):
+        self.engine = engine
+        self.timings = []
+
+    def query(self, sql, params=None, **kwargs):
+        with self.engine.connect() as connection:
+            start = time.perf_counter()
+            result = pd.read_sql(text(sql), connection, params=params)
+            self.timings.append((time.perf_counter() - start) * 1000)
+        return result
+
+    def estimate_rows(self, sql, params=None):
+        # Paged-table counts past COUNT_LIMIT; not timed, it is only planned
+        return estimate_rows(self.engine, sql, params)
+
+
+def time_queries(engine, runs):
+    # Median time of every dashboard query, with the result cache bypassed
+    results = {}
+    for name, fetch in sql_fetches():
+        conn = TimingConnection(engine)
+        for _ in range(runs):
+            result = fetch.__wrapped__(conn)
+        # Row counts come back as a number rather than a frame
+        rows = result if isinstance(result, int) else len(result)
+        results[name] = {"ms": round(statistics.median(conn.timings), 2), "rows": rows}
+    return results
+
+
+def run_section(section):
+    # A fresh session rendering one section; returns its profile record
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP, default_timeout=RUN_TIMEOUT)
+    app.run()
+    if section != SECTIONS[0]:
+        app.sidebar.radio[0].set_value(section).run()
+    if app.exception:
+        raise RuntimeError(f"{section} failed: {app.exception[0].message}")
+    return app, app.session_state["profile"].sections[-1]
+
+
+def release_sessions():
+    # Closes the dashboard's pooled connections along with its caches, so the
+    # next run starts cold and from a fresh pool
+    get_connection().dispose()
+    st.cache_resource.clear()
+
+
+def time_sections():
+    # Cold: every cache emptied first, so queries run; warm: the same
+    # section again, answered from the result cache
+    results = {}
+    for section in SECTIONS:
+        release_sessions()
+        app, cold = run_section(section)
+        app.run()
+        warm = app.session_state["profile"].sections[-1]
+        results[section] = {
+            "cold_ms": cold["total_ms"],
+            "cold_render_ms": cold["render_ms"],
+            "warm_ms": warm["total_ms"],
+        }
+    return results
+
+
+def benchmark(engine, scales, seed, runs):
+    results = {}
+    for label in scales:
+        generate(engine, parse_scale(label), seed, replace=True)
+        results[label] = {"queries": time_queries(engine, runs), "sections": time_sections()}
+        release_sessions()
+    return {"seed": seed, "runs": runs, "scales": results}
+
+
+def _change(new, old):
+    if old is None:
+        return ""
+    return f" ({(new - old) / old * 100:+.0f}%)" if old else ""
+
+
+def report(results, baseline=None):
+    # Markdown tables per scale; with a baseline, the change against it
+    baseline = (baseline or {}).get("scales", {})
+    lines = []
+    for label, result in results["scales"].items():
+        base = baseline.get(label, {})
+        lines += [f"## {label} order lines", "", "| query | rows | ms |", "|---|---|---|"]
+        for name, timing in result["queries"].items():
+            old = base.get("queries", {}).get(name, {}).get("ms")
+            lines.append(f"| `{name}` | {timing['rows']} | {timing['ms']:.2f}{_change(timing['ms'], old)} |")
+        lines += ["", "| section | cold ms | cold render ms | warm ms |", "|---|---|---|---|"]
+        for section, timing in result["sections"].items():
+            old = base.get("sections", {}).get(section, {})
+            lines.append(
+                f"| {section} | {timing['cold_ms']:.0f}{_change(timing['cold_ms'], old.get('cold_ms'))} "
+                f"| {timing['cold_render_ms']:.0f}{_change(timing['cold_render_ms'], old.get('cold_render_ms'))} "
+                f"| {timing['warm_ms']:.0f}{_change(timing['warm_ms'], old.get('warm_ms'))} |"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time every dashboard query and section on synthetic data at several scales. "
+        "Overwrites the webshop data of the database it points at."
+    )
+    parser.add_argument("scales", nargs="*", default=["10k", "100k", "1M"], help="order lines per run, e.g. 10k 1M 50M")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=3, help="times each query is run; the median is reported")
+    parser.add_argument("--out", help="write the raw results here as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(database_url())
+    # The sections connect through main.py, which reads DATABASE_URL
+    os.environ["DATABASE_URL"] = engine.url.render_as_string(hide_password=False)
+    results = benchmark(engine, args.scales, args.seed, args.runs)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(report(results, baseline))
@@ -0,0 +1,63 @@
+import time
+
+STARTED = time.perf_counter()
+
+import logging
+import os
+import sys
+
+from profiling import record_boot
+
+logger = logging.getLogger(__name__)
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+# Seconds the warm-up may take in all; 0 skips it. Heroku gives a web dyno
+# 60 s to open its port.
+WARMUP_SECONDS = float(os.environ.get("WEBSHOP_WARMUP_SECONDS", "45"))
+
+
+def warm_up(budget=WARMUP_SECONDS):
+    # Renders every section once in this process, as a first visitor would.
+    # The imports, result cache, dimension registry and connection pool are
+    # all process-wide, so the sessions the server opens afterwards start
+    # from them instead of from cold.
+    from streamlit.testing.v1 import AppTest
+
+    deadline = time.perf_counter() + budget
+    app = AppTest.from_file(APP)
+    start = time.perf_counter()
+    app.run(timeout=budget)
+    sections = app.sidebar.radio[0].options
+    record_boot(f"warm {sections[0]}", time.perf_counter() - start)
+    for section in sections[1:]:
+        if time.perf_counter() >= deadline:
+            logger.warning("warm-up budget spent before the %s section", section)
+            break
+        start = time.perf_counter()
+        app.sidebar.radio[0].set_value(section).run(timeout=deadline - start)
+        record_boot(f"warm {section}", time.perf_counter() - start)
+    for exception in app.exception:
+        logger.warning("warm-up run failed: %s", exception.message)
+
+
+def serve(args):
+    # The same server `streamlit run main.py` starts, in this process
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", APP, *args]
+    cli.main()
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    logger.setLevel(logging.INFO)
+    if WARMUP_SECONDS > 0:
+        try:
+            warm_up()
+        except Exception:
+            # A cold dashboard is better than none
+            logger.exception("warm-up failed")
+    ready = time.perf_counter() - STARTED
+    record_boot("ready", ready)
+    logger.info("ready in %.1f s", ready)
+    serve(sys.argv[1:])
@@ -0,0 +1,157 @@
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+from profiling import fetching, ms, record_fetch, result_size
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached result stays fresh, per policy
+POLICIES = {
+    "stock": 5 * 60,
+    "sales": 60 * 60,
+    "customers": 60 * 60,
+    "rollups": 24 * 60 * 60,
+}
+
+DEFAULT_BUDGET_MB = 256
+
+
+class CacheEntry:
+    def __init__(self, name, args, policy, value):
+        self.name = name
+        self.args = args
+        self.policy = policy
+        self.value = value
+        self.nbytes = result_size(value)
+        self.created = time.time()
+        self.expires = self.created + POLICIES[policy]
+
+
+class ResultCache:
+    # Process-wide result cache: per-policy TTLs, a global memory budget and
+    # least-recently-used eviction once the budget is exceeded
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._key_locks = {}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+
+    def _put(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if entry.nbytes > self.max_bytes:
+                logger.warning(
+                    "%s result (%d bytes) exceeds the cache budget, not cached",
+                    entry.name,
+                    entry.nbytes,
+                )
+                return
+            self._entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                evicted = next(iter(self._entries))
+                logger.info("evicting %s from the result cache", self._entries[evicted].name)
+                self._remove(evicted)
+
+    def get_or_compute(self, key, name, args, policy, compute):
+        entry = self._get(key)
+        if entry is not None:
+            return entry.value
+
+        # Concurrent misses on one key compute it once. The key's lock is
+        # dropped once nobody is waiting on it, so locks don't pile up for
+        # every key ever computed.
+        with self._lock:
+            key_lock, waiting = self._key_locks.get(key, (threading.Lock(), 0))
+            self._key_locks[key] = (key_lock, waiting + 1)
+        try:
+            with key_lock:
+                entry = self._get(key)
+                if entry is None:
+                    entry = CacheEntry(name, args, policy, compute())
+                    self._put(key, entry)
+        finally:
+            with self._lock:
+                key_lock, waiting = self._key_locks.pop(key)
+                if waiting > 1:
+                    self._key_locks[key] = (key_lock, waiting - 1)
+        return entry.value
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def invalidate(self, keys=None):
+        # Drops the given keys, or everything
+        with self._lock:
+            for key in list(self._entries) if keys is None else keys:
+                if key in self._entries:
+                    self._remove(key)
+
+
+@st.cache_resource
+def get_result_cache():
+    budget_mb = float(os.environ.get("WEBSHOP_CACHE_MB", DEFAULT_BUDGET_MB))
+    return ResultCache(max_bytes=int(budget_mb * 1024 * 1024))
+
+
+def cached(policy):
+    # Like st.cache_data: arguments whose name starts with "_" are not part of
+    # the key, and callers get a copy they are free to modify
+    if policy not in POLICIES:
+        raise ValueError(f"unknown cache policy {policy!r}")
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key_args = tuple(
+                (name, repr(value))
+                for name, value in bound.arguments.items()
+                if not name.startswith("_")
+            )
+            computed = []
+
+            def compute():
+                computed.append(True)
+                with fetching(func.__name__):
+                    return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            value = get_result_cache().get_or_compute(
+                (func.__name__, key_args), func.__name__, key_args, policy, compute
+            )
+            record_fetch(func.__name__, not computed, ms(start), value)
+            return value.copy() if hasattr(value, "copy") else value
+
+        wrapper.policy = policy
+        return wrapper
+
+    return decorator
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Most points a chart sends to the browser; Altair embeds every row of its
+# data in the spec. Override one with e.g. WEBSHOP_POINTS_CUSTOMERS_SCATTER.
+POINT_BUDGETS = {
+    "category_lines": 2000,
+    "customers_scatter": 5000,
+}
+
+
+def point_budget(chart):
+    return int(os.environ.get(f"WEBSHOP_POINTS_{chart.upper()}", POINT_BUDGETS[chart]))
+
+
+def _positions(values):
+    # Numeric x positions: numbers as they are, dates (or "YYYY-MM" strings)
+    # as timestamps, anything else by order
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+    try:
+        return pd.to_datetime(values).to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(float)
+    except (ValueError, TypeError):
+        return np.arange(len(values), dtype=float)
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of the threshold points that
+    # best keep the visual shape of a line
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        selected.append(a)
+    selected.append(n - 1)
+    return np.array(selected)
+
+
+def downsample_lines(df, x, y, group, points):
+    # One LTTB pass per line, the budget shared evenly between the lines
+    if len(df) <= points:
+        return df
+    per_line = max(3, points // df[group].nunique())
+    parts = []
+    for _, line in df.groupby(group, sort=False, observed=True):
+        line = line.sort_values(x)
+        keep = lttb(_positions(line[x]), line[y].to_numpy(dtype=float), per_line)
+        parts.append(line.iloc[keep])
+    return pd.concat(parts, ignore_index=True)
+
+
+def bin_scatter(df, x, y, color, points):
+    # Above the budget, points are aggregated on a grid per color: one mark
+    # per occupied cell at the cell's mean, with the number of points in it
+    if len(df) <= points:
+        return df
+    bins = max(1, int(np.sqrt(points / max(1, df[color].nunique(dropna=False)))))
+    cells = df.assign(
+        _x=pd.cut(df[x], bins, labels=False),
+        _y=pd.cut(df[y], bins, labels=False),
+    )
+    binned = (
+        cells.groupby([color, "_x", "_y"], dropna=False, observed=True)
+        .agg(**{x: (x, "mean"), y: (y, "mean"), "count": (x, "size")})
+        .reset_index()
+    )
+    return binned[[color, x, y, "count"]]
@@ -0,0 +1,488 @@
+import hashlib
+import inspect
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+import sqlalchemy
+import streamlit as st
+from sqlalchemy import text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from profiling import (
+    begin_profile,
+    current_profile,
+    ms,
+    pool_timed_out,
+    pool_wait_ms,
+    query_started,
+    record_query,
+    record_run,
+    record_wait,
+    result_size,
+    watch_pool,
+)
+from store import ResultStore
+
+logger = logging.getLogger(__name__)
+
+# Pool and statement-timeout settings: the [connections.postgresql] entry of
+# secrets.toml can set each one, its WEBSHOP_* variable overrides that
+CONNECTION_SETTINGS = {
+    "pool_size": ("WEBSHOP_POOL_SIZE", 5),
+    "max_overflow": ("WEBSHOP_POOL_MAX_OVERFLOW", 5),
+    "pool_timeout": ("WEBSHOP_POOL_TIMEOUT", 30),
+    "pool_pre_ping": ("WEBSHOP_POOL_PRE_PING", True),
+    "pool_recycle": ("WEBSHOP_POOL_RECYCLE", 30 * 60),
+    "statement_timeout_ms": ("WEBSHOP_STATEMENT_TIMEOUT_MS", 60_000),
+}
+
+# Rows per chunk of a streamed read (QueryLayer.stream); 0 reads every result whole
+STREAM_CHUNK_ROWS = int(os.environ.get("WEBSHOP_STREAM_CHUNK_ROWS", "50000"))
+
+# Seconds the data-version stamp is reused before it is read again
+DATA_VERSION_TTL = 60
+
+# Write counters of the webshop tables; they also change when the server
+# restarts, which only costs a cold result store
+DATA_VERSION_SQL = """SELECT pg_postmaster_start_time()::text || '/' ||
+    COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)::text AS version
+    FROM pg_stat_user_tables
+    WHERE schemaname = 'webshop'"""
+
+# String literals and quoted identifiers are kept verbatim, any other run of
+# whitespace collapses to a single space
+_SQL_TOKENS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+
+
+@st.cache_resource
+def get_connection():
+    # WEBSHOP_BACKEND=duckdb serves the dashboard from db_dump/mydb.dump (or a
+    # Parquet export of it, see offline.py) without a Postgres server
+    if os.environ.get("WEBSHOP_BACKEND") == "duckdb":
+        from offline import connect
+
+        return connect(os.environ.get("WEBSHOP_OFFLINE_SOURCE"))
+
+    settings = connection_settings()
+    engine = create_engine(database_url(), settings)
+    watch_pool(engine, "primary")
+
+    # Read-only dashboard queries can go to a replica instead
+    replica_url = os.environ.get("WEBSHOP_REPLICA_URL") or _secrets().get("replica_url")
+    replica = None
+    if replica_url:
+        replica = create_engine(replica_url.replace("postgres://", "postgresql://"), settings)
+        watch_pool(replica, "replica")
+    return PostgresConnection(engine, replica)
+
+
+def _secrets():
+    try:
+        return st.secrets["connections"]["postgresql"]
+    except (FileNotFoundError, KeyError):
+        return {}
+
+
+def _setting(value, default):
+    # Env values are strings; parse them as the default's type
+    if isinstance(default, bool):
+        return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+
+def connection_settings():
+    secrets = _secrets()
+    return {
+        name: _setting(os.environ.get(env, secrets.get(name, default)), default)
+        for name, (env, default) in CONNECTION_SETTINGS.items()
+    }
+
+
+def create_engine(url, settings):
+    connect_args = {}
+    if settings["statement_timeout_ms"]:
+        connect_args["options"] = f"-c statement_timeout={settings['statement_timeout_ms']}"
+    return sqlalchemy.create_engine(
+        url,
+        pool_size=settings["pool_size"],
+        max_overflow=settings["max_overflow"],
+        pool_timeout=settings["pool_timeout"],
+        pool_pre_ping=settings["pool_pre_ping"],
+        pool_recycle=settings["pool_recycle"],
+        connect_args=connect_args,
+    )
+
+
+class PostgresConnection:
+    # Stand-in for st.connection("postgresql", type="sql") over one pooled
+    # engine per process: each query checks a connection out and returns it
+    # when done (st.connection keeps it open in a transaction), and reads go
+    # to the replica when there is one
+    def __init__(self, engine, replica=None):
+        self.engine = engine
+        self.replica = replica
+
+    def query(self, sql, params=None, ttl=None, primary=False, timeout_ms=None, **kwargs):
+        # ttl is accepted for st.connection's signature; cache.py does the caching.
+        # primary=True reads from the primary even with a replica, and
+        # timeout_ms overrides the statement timeout for this query.
+        engine = self.engine if primary or self.replica is None else self.replica
+        if kwargs.get("chunksize"):
+            return self._chunks(engine, sql, params, timeout_ms, kwargs)
+        with self._connect(engine, timeout_ms) as connection:
+            return pd.read_sql(text(sql), connection, params=params, **kwargs)
+
+    def stream(self, sql, params=None, chunk_rows=STREAM_CHUNK_ROWS, primary=False):
+        # Frames of at most chunk_rows rows through a server-side cursor, so
+        # the driver never holds more than one chunk of the result
+        engine = self.engine if primary or self.replica is None else self.replica
+        with self._connect(engine, None) as connection:
+            # The whole result is read, so plan for all of it rather than the
+            # fast first rows Postgres assumes for a cursor
+            connection.execute(text("SET LOCAL cursor_tuple_fraction = 1.0"))
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=chunk_rows
+            ).execute(text(sql), params or {})
+            columns = list(result.keys())
+            empty = True
+            for rows in result.partitions(chunk_rows):
+                empty = False
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            if empty:
+                yield pd.DataFrame(columns=columns)
+
+    def _chunks(self, engine, sql, params, timeout_ms, kwargs):
+        # The connection stays checked out until the last chunk is read
+        with self._connect(engine, timeout_ms) as connection:
+            yield from pd.read_sql(text(sql), connection, params=params, **kwargs)
+
+    def _connect(self, engine, timeout_ms):
+        try:
+            connection = engine.connect()
+        except sqlalchemy.exc.TimeoutError:
+            pool_timed_out(engine)
+            raise
+        if timeout_ms is not None:
+            # Local to the query's transaction, which ends with the connection
+            connection.execute(
+                text("SELECT set_config('statement_timeout', :timeout, true)"),
+                {"timeout": str(int(timeout_ms))},
+            )
+        return connection
+
+    def dispose(self):
+        self.engine.dispose()
+        if self.replica is not None:
+            self.replica.dispose()
+
+
+# For jobs running outside Streamlit; mirrors what get_connection() connects to
+def database_url():
+    db_url = os.environ.get("DATABASE_URL")
+
+    if db_url is not None:
+        return db_url.replace("postgres://", "postgresql://")
+
+    secrets = _secrets()
+    return sqlalchemy.engine.URL.create(
+        drivername=secrets["dialect"],
+        username=secrets.get("username"),
+        password=secrets.get("password") or None,
+        host=secrets.get("host"),
+        port=int(secrets["port"]) if secrets.get("port") else None,
+        database=secrets.get("database"),
+    )
+
+
+def normalize_sql(sql):
+    return _SQL_TOKENS.sub(lambda m: m.group(1) or " ", sql).strip().rstrip(";").strip()
+
+
+def query_key(sql, params=None):
+    if params is None:
+        params = {}
+    elif not isinstance(params, dict):
+        params = dict(enumerate(params))
+    return normalize_sql(sql), repr(sorted(params.items(), key=lambda item: str(item[0])))
+
+
+class QueryRun:
+    # Per script run: results already fetched in this run and round-trip counters
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+        self.sent = 0
+        self.saved = 0
+
+
+def begin_run():
+    st.session_state["query_run"] = QueryRun()
+    begin_profile()
+
+
+def current_run():
+    try:
+        return st.session_state.get("query_run")
+    except Exception:
+        # No script run context (e.g. a background thread)
+        return None
+
+
+def end_run():
+    run = current_run()
+    if run is not None:
+        run.results.clear()
+        record_run(run.sent, run.saved)
+
+
+class QueryLayer:
+    # Sits between the dashboard and st.connection: identical queries issued
+    # in the same run are answered from that run's results, identical
+    # queries already in flight (from any session) are sent only once, and,
+    # with a result store, results are shared with every other process.
+    def __init__(self, conn, store=None):
+        self._conn = conn
+        self._store = store
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._versions = {}
+
+    def data_version(self, tables=None):
+        # Stamp that changes whenever webshop data (or that of the given
+        # tables) changes; stored results are keyed by it, so a write makes
+        # them all stale at once
+        now = time.monotonic()
+        version, version_at = self._versions.get(tables, (None, 0.0))
+        if version is None or now - version_at > DATA_VERSION_TTL:
+            stamp = getattr(self._conn, "data_version", None)
+            if stamp is not None:
+                version = stamp()
+            elif tables is None:
+                # Write counters are only kept on the primary
+                version = self._conn.query(DATA_VERSION_SQL, ttl=0, primary=True)["version"].iloc[0]
+            else:
+                version = self._conn.query(
+                    DATA_VERSION_SQL + " AND relname = ANY(:tables)",
+                    params={"tables": list(tables)},
+                    ttl=0,
+                    primary=True,
+                )["version"].iloc[0]
+            self._versions[tables] = (version, now)
+        return version
+
+    def explain(self, sql, params=None):
+        # EXPLAIN ANALYZE plan of a query, for the admin profiling panel;
+        # runs the query a second time
+        explain = getattr(self._conn, "explain", None)
+        if explain is not None:
+            return explain(sql, params)
+        result = self._conn.query(
+            f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params=params, ttl=0
+        )
+        return result.iloc[0, 0][0]
+
+    def estimate_rows(self, sql, params=None):
+        # The planner's row estimate for a query, without running it
+        estimate = getattr(self._conn, "estimate_rows", None)
+        if estimate is not None:
+            return estimate(sql, params)
+        result = self._conn.query(f"EXPLAIN (FORMAT JSON) {sql}", params=params, ttl=0)
+        return int(result.iloc[0, 0][0]["Plan"]["Plan Rows"])
+
+    def _store_key(self, key, variant=None):
+        stamp = (key, self.data_version())
+        if variant is not None:
+            stamp = (key, variant, self.data_version())
+        return hashlib.sha256(repr(stamp).encode()).hexdigest()
+
+    def load(self, sql, params=None, variant=None):
+        # A result put in the store by save(), or None. variant tells apart
+        # results of the same query that were prepared differently.
+        if self._store is None:
+            return None
+        start = time.perf_counter()
+        key = query_key(sql, params)
+        result = self._store.get(self._store_key(key, variant))
+        if result is not None:
+            record_query(key[0], "store", ms(start), 0.0, result)
+        return result
+
+    def save(self, sql, params, result, variant=None):
+        # Stores a result assembled by the caller, e.g. from stream()
+        if self._store is not None:
+            self._store.put(self._store_key(query_key(sql, params), variant), result)
+
+    def _fetch(self, key, params, kwargs, start):
+        # Returns the result and whether it came from the result store
+        store_key = None
+        if self._store is not None and "chunksize" not in kwargs:
+            store_key = self._store_key(key)
+            result = self._store.get(store_key)
+            if result is not None:
+                record_query(key[0], "store", ms(start), 0.0, result)
+                return result, True
+
+        db_start = time.perf_counter()
+        query_started()
+        result = self._conn.query(key[0], params=params, **kwargs)
+        db_ms = ms(db_start)
+        pool_wait = pool_wait_ms()
+        if store_key is not None:
+            self._store.put(store_key, result)
+
+        plan = None
+        profile = current_profile()
+        if profile is not None and profile.explain:
+            try:
+                plan = self.explain(key[0], params)
+            except Exception:
+                logger.warning("could not explain query", exc_info=True)
+        record_query(key[0], "db", ms(start), db_ms, result, plan, pool_wait)
+        return result, False
+
+    def stream(self, sql, params=None, chunk_rows=STREAM_CHUNK_ROWS):
+        # Yields the result a chunk at a time as the database sends it. The
+        # whole result never exists at once, so unlike query() it is not
+        # memoized, shared with concurrent callers or stored; callers that
+        # assemble it store that with save().
+        stream = getattr(self._conn, "stream", None)
+        if not chunk_rows or stream is None:
+            yield self.query(sql, params)
+            return
+        start = time.perf_counter()
+        db_seconds = 0.0
+        rows = nbytes = 0
+        pool_wait = None
+        query_started()
+        chunks = stream(sql, params=params, chunk_rows=chunk_rows)
+        while True:
+            # Database time is spent in next(); the caller's work on each
+            # chunk happens between the calls
+            db_start = time.perf_counter()
+            chunk = next(chunks, None)
+            db_seconds += time.perf_counter() - db_start
+            if chunk is None:
+                break
+            if pool_wait is None:
+                pool_wait = pool_wait_ms()
+            rows += len(chunk.index)
+            nbytes += result_size(chunk)
+            yield chunk
+        record_query(
+            normalize_sql(sql),
+            "stream",
+            ms(start),
+            round(db_seconds * 1000, 2),
+            None,
+            pool_wait=pool_wait,
+            rows=rows,
+            nbytes=nbytes,
+        )
+
+    def query(self, sql, params=None, **kwargs):
+        start = time.perf_counter()
+        key = query_key(sql, params)
+        run = current_run()
+
+        if run is not None:
+            with run.lock:
+                cached = run.results.get(key)
+                if cached is not None:
+                    run.saved += 1
+            if cached is not None:
+                record_query(key[0], "run", ms(start), 0.0, cached)
+                return cached.copy()
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if leader:
+            # Results are cached by cache.py's policies; ttl=0 keeps
+            # st.connection from also caching them forever
+            kwargs.setdefault("ttl", 0)
+            try:
+                result, stored = self._fetch(key, params, kwargs, start)
+                future.set_result(result)
+            except BaseException as exc:
+                future.set_exception(exc)
+                raise
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+        else:
+            result = future.result().copy()
+            record_query(key[0], "in flight", ms(start), 0.0, result)
+
+        if run is not None:
+            with run.lock:
+                if leader and not stored:
+                    run.sent += 1
+                else:
+                    run.saved += 1
+                run.results[key] = result
+            return result.copy()
+        return result
+
+
+@st.cache_resource
+def get_query_layer():
+    location = os.environ.get("WEBSHOP_RESULT_STORE")
+    return QueryLayer(get_connection(), ResultStore(location) if location else None)
+
+
+def pool_size(conn, default=5):
+    # Size of the SQLAlchemy pool behind the connection, if there is one
+    engine = getattr(conn, "engine", None)
+    size = getattr(getattr(engine, "pool", None), "size", None)
+    return size() if callable(size) else default
+
+
+@st.cache_resource
+def get_prefetch_executor():
+    # Shared by all sessions and no wider than the connection pool, so
+    # prefetching never queues on pool checkouts
+    return ThreadPoolExecutor(
+        max_workers=pool_size(get_connection()), thread_name_prefix="prefetch"
+    )
+
+
+class Prefetch:
+    # Runs fetch functions in the background from the top of the script;
+    # get() waits for the submitted result, or fetches inline if it was not
+    # submitted. Keyword params (the selected period) go to every fetch that
+    # takes them.
+    def __init__(self, conn, fetches, **params):
+        self._conn = conn
+        self.params = params
+        ctx = get_script_run_ctx()
+
+        def run(fetch):
+            # Lets cached functions and the query layer see this session
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return fetch(conn, **self._params_for(fetch))
+
+        executor = get_prefetch_executor()
+        self._futures = {fetch: executor.submit(run, fetch) for fetch in fetches}
+
+    def _params_for(self, fetch):
+        accepted = inspect.signature(fetch).parameters
+        return {name: value for name, value in self.params.items() if name in accepted}
+
+    def get(self, fetch):
+        future = self._futures.get(fetch)
+        if future is None:
+            return fetch(self._conn, **self._params_for(fetch))
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            record_wait(time.perf_counter() - start)
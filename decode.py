@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+_INT32 = np.iinfo(np.int32)
+
+
+def decode_money(values, as_cents=False):
+    # money arrives as float8 when the SQL casts it, or as text in the
+    # server's locale ("$1,234.56") when it does not
+    if values.dtype == object:
+        values = pd.to_numeric(values.str.replace(r"[^0-9.-]", "", regex=True))
+    values = values.astype("float64")
+    if as_cents:
+        return (values * 100).round().astype("Int64" if values.isna().any() else "int64")
+    return values
+
+
+def compact(df, categories=(), money=(), as_cents=False):
+    # Low-cardinality text as pandas categories, money as float64 (or int64
+    # cents) and integers as int32 where they fit. Not smaller: groupby sums
+    # keep the column's dtype and would overflow.
+    for column in money:
+        df[column] = decode_money(df[column], as_cents)
+    for column in categories:
+        df[column] = df[column].astype("category")
+    for column in df.select_dtypes("int64").columns:
+        if len(df) and _INT32.min <= df[column].min() and df[column].max() <= _INT32.max:
+            df[column] = df[column].astype("int32")
+    return df
+
+
+def compact_chunks(chunks, categories=(), money=(), as_cents=False):
+    # compact() over a result read in chunks: each chunk is compacted as it
+    # arrives, then the categories are unified so concat keeps them. The copy
+    # drops any views into the raw chunk, which would keep it all alive.
+    parts = [compact(chunk, categories, money, as_cents).copy() for chunk in chunks]
+    if len(parts) == 1:
+        return parts[0]
+    for column in parts[0].select_dtypes("category").columns:
+        # Sorted, as astype("category") would have, for the columns compact()
+        # made categorical; others keep the order they were given
+        union = union_categoricals(
+            [part[column] for part in parts], sort_categories=column in categories
+        ).categories
+        for part in parts:
+            part[column] = part[column].cat.set_categories(union)
+    # A chunk whose integers fitted int32 may meet one that did not
+    return compact(pd.concat(parts, ignore_index=True))
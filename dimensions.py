@@ -0,0 +1,102 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Writes to these tables can change a dimension
+DIMENSION_TABLES = ("products", "sizes", "colors", "labels")
+
+# Distinct categories by skipping through products_category_idx, one probe
+# per category instead of a scan of every product
+CATEGORIES_SQL = """WITH RECURSIVE categories AS (
+        SELECT MIN(category) AS category FROM webshop.products
+        UNION ALL
+        SELECT (SELECT MIN(p.category) FROM webshop.products AS p WHERE p.category > c.category)
+        FROM categories AS c
+        WHERE c.category IS NOT NULL)
+    SELECT category::text AS name FROM categories WHERE category IS NOT NULL"""
+
+SIZES_SQL = """SELECT id, size AS name FROM webshop.sizes ORDER BY id"""
+COLORS_SQL = """SELECT id, name FROM webshop.colors ORDER BY id"""
+LABELS_SQL = """SELECT id, name FROM webshop.labels ORDER BY id"""
+PRODUCTS_SQL = """SELECT id, name FROM webshop.products ORDER BY id"""
+
+
+class Dimensions:
+    # One load of every dimension as an (id, name) frame. Categories have no
+    # table of their own and are numbered 1..n in enum order; sizes are
+    # listed per gender and category, so one size name has several ids, and
+    # a product name can be shared by products in different categories.
+    def __init__(self, version, categories, sizes, colors, labels, products):
+        self.version = version
+        categories = categories.reset_index(drop=True)
+        categories.insert(0, "id", np.arange(1, len(categories.index) + 1))
+        self.categories = categories
+        self.sizes = sizes
+        self.colors = colors
+        self.labels = labels
+        self.products = products
+
+    def size_names(self):
+        # One row per size name in size order, keyed by its first id
+        return self.sizes.drop_duplicates("name")
+
+    def names(self, dimension, ids):
+        frame = getattr(self, dimension)
+        return frame.loc[frame["id"].isin(ids), "name"].unique().tolist()
+
+    def ids(self, dimension, names):
+        frame = getattr(self, dimension)
+        return frame.loc[frame["name"].isin(names), "id"].tolist()
+
+    def decode(self, dimension, ids):
+        # Names for a column of ids as a pandas categorical; unknown or null
+        # ids become NaN, as with a LEFT JOIN
+        frame = getattr(self, dimension)
+        names = pd.Index(frame["name"].unique())
+        codes_by_row = names.get_indexer(frame["name"])
+        # Compared as floats: an id column with nulls arrives as float64
+        rows = pd.Index(frame["id"].astype("float64")).get_indexer(np.asarray(ids, dtype="float64"))
+        codes = np.where(rows >= 0, codes_by_row[rows], -1)
+        return pd.Categorical.from_codes(codes, categories=names)
+
+
+def load(conn, version=None):
+    return Dimensions(
+        version,
+        conn.query(sql=CATEGORIES_SQL),
+        conn.query(sql=SIZES_SQL),
+        conn.query(sql=COLORS_SQL),
+        conn.query(sql=LABELS_SQL),
+        conn.query(sql=PRODUCTS_SQL),
+    )
+
+
+class DimensionRegistry:
+    # Process-wide: every session and query shares one load of the
+    # dimensions, reloaded only when the dimension tables' write counters move
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dimensions = None
+
+    def get(self, conn):
+        data_version = getattr(conn, "data_version", None)
+        version = data_version(DIMENSION_TABLES) if data_version is not None else None
+        with self._lock:
+            if self._dimensions is None or self._dimensions.version != version:
+                self._dimensions = load(conn, version)
+            return self._dimensions
+
+    def invalidate(self):
+        with self._lock:
+            self._dimensions = None
+
+
+@st.cache_resource
+def get_dimension_registry():
+    return DimensionRegistry()
+
+
+def get_dimensions(conn):
+    return get_dimension_registry().get(conn)
@@ -0,0 +1,159 @@
+import argparse
+import inspect
+import re
+from collections import Counter
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import text
+
+import dimensions
+import queries
+from cache import get_result_cache
+from db import database_url
+from migrate import migrate
+
+# A fetch function sends SQL itself when it queries or streams from _conn
+_SENDS_SQL = re.compile(r"_conn\.query\(|_read\(\s*_conn|_count_rows\(\s*_conn")
+
+# Each query is analyzed this many times and the fastest run is reported
+RUNS = 3
+
+# The cursor columns main.py pages these fetches by, so the report covers
+# a keyset page after the first as well
+PAGE_KEYS = {
+    "fetch_top_products_page": ["Total sales volume", "name", "category"],
+    "fetch_stock_page": ["stock_article_id"],
+}
+
+
+def plan_nodes(plan):
+    # "Node Type on relation/index" for every node of a JSON plan
+    node = plan["Node Type"]
+    target = plan.get("Index Name") or plan.get("Relation Name")
+    nodes = [f"{node} on {target}" if target else node]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def estimate_rows(engine, sql, params=None):
+    # The planner's row estimate, for connections standing in for QueryLayer
+    with engine.connect() as connection:
+        plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params or {}).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class ExplainConnection:
+    # Runs each dashboard query for real, so the fetch functions can keep
+    # deriving from its result, and records its EXPLAIN ANALYZE plan
+    def __init__(self, engine):
+        self.engine = engine
+        self.plans = {}
+        self.fetch = None
+        self.sent = Counter()
+
+    def query(self, sql, params=None, **kwargs):
+        with self.engine.connect() as connection:
+            if sql not in self.plans:
+                runs = [
+                    connection.execute(
+                        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params or {}
+                    ).scalar()[0]
+                    for _ in range(RUNS)
+                ]
+                best = min(runs, key=lambda run: run["Execution Time"])
+                # A fetch's second and later queries are numbered
+                self.sent[self.fetch] += 1
+                n = self.sent[self.fetch]
+                self.plans[sql] = {
+                    "fetch": self.fetch if n == 1 else f"{self.fetch} #{n}",
+                    "execution_ms": best["Execution Time"],
+                    "planning_ms": best["Planning Time"],
+                    "nodes": plan_nodes(best["Plan"]),
+                }
+            return pd.read_sql(text(sql), connection, params=params)
+
+    def estimate_rows(self, sql, params=None):
+        return estimate_rows(self.engine, sql, params)
+
+
+def sql_fetches():
+    # The fetch functions that send SQL; the others only derive from them
+    return [
+        (name, fetch)
+        for name, fetch in inspect.getmembers(queries, inspect.isfunction)
+        if name.startswith("fetch_") and _SENDS_SQL.search(inspect.getsource(fetch))
+    ]
+
+
+def explain_dashboard(engine):
+    # Every fetch over the whole history, and again over its last month as the
+    # sidebar's date range narrows it; paged fetches also for their next page
+    get_result_cache().invalidate()
+    conn = ExplainConnection(engine)
+    for name in ["CATEGORIES_SQL", "SIZES_SQL", "COLORS_SQL", "LABELS_SQL", "PRODUCTS_SQL"]:
+        conn.fetch = f"dimensions.{name}"
+        conn.query(getattr(dimensions, name))
+    conn.fetch = "fetch_order_months"
+    months = queries.fetch_order_months.__wrapped__(conn)
+    period = (months[-1], (pd.Timestamp(months[-1]) + pd.offsets.MonthBegin()).date()) if months else None
+    if period is not None:
+        # Cached here, so the fetches bounded by the period reuse it
+        conn.fetch = "fetch_order_id_range (last month)"
+        queries.fetch_order_id_range(conn, period)
+
+    for name, fetch in sql_fetches():
+        # Bypass the result cache so every query reaches the database
+        conn.fetch = name
+        first_page = fetch.__wrapped__(conn)
+        if name in PAGE_KEYS and len(first_page.index):
+            conn.fetch = f"{name} (next page)"
+            fetch.__wrapped__(conn, after=tuple(first_page[PAGE_KEYS[name]].iloc[-1].tolist()))
+        if period is not None and "period" in inspect.signature(fetch).parameters:
+            conn.fetch = f"{name} (last month)"
+            fetch.__wrapped__(conn, period=period)
+    return {plan["fetch"]: plan for plan in conn.plans.values()}
+
+
+def scans(plan):
+    return "<br>".join(sorted({node for node in plan["nodes"] if "Scan" in node}))
+
+
+def report(before, after=None):
+    after = after or {}
+    lines = [
+        "| query | before (ms) | after (ms) | scans before | scans after |",
+        "|---|---|---|---|---|",
+    ]
+    for fetch, plan in sorted(before.items()):
+        new = after.get(fetch)
+        after_ms = f"{new['execution_ms']:.2f}" if new else "-"
+        lines.append(
+            f"| `{fetch}` | {plan['execution_ms']:.2f} | {after_ms} "
+            f"| {scans(plan)} | {scans(new) if new else '-'} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="EXPLAIN ANALYZE every dashboard query, optionally around the migrations"
+    )
+    parser.add_argument("--migrate", action="store_true", help="apply pending migrations between the two runs")
+    parser.add_argument("--out", help="write the markdown report here instead of stdout")
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(database_url())
+    before = explain_dashboard(engine)
+    after = None
+    if args.migrate:
+        migrate(engine)
+        after = explain_dashboard(engine)
+
+    markdown = report(before, after)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(markdown)
+    else:
+        print(markdown)
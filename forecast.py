@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+# Smoothing factor per week: higher follows the latest weeks more closely
+FORECAST_ALPHA = float(os.environ.get("WEBSHOP_FORECAST_ALPHA", "0.2"))
+# An order should bring an article's stock up to this many days of demand
+RESTOCK_COVER_DAYS = int(os.environ.get("WEBSHOP_RESTOCK_COVER_DAYS", "28"))
+
+
+def smoothed_demand(series, weeks_ago, amounts, n_series, n_weeks, alpha=FORECAST_ALPHA):
+    # Simple exponential smoothing of n_series weekly series at once, given
+    # as sparse (series, weeks before the last week, amount) triples. The
+    # recursion level = alpha * demand + (1 - alpha) * level unrolls into a
+    # weighted sum of the weeks, so every series' last level is one bincount.
+    # Levels start at the series' mean week.
+    weights = alpha * (1 - alpha) ** weeks_ago
+    level = np.bincount(series, weights=amounts * weights, minlength=n_series)
+    mean = np.bincount(series, weights=amounts, minlength=n_series) / n_weeks
+    return level + (1 - alpha) ** n_weeks * mean
+
+
+def restock(quantity_left, daily_demand, cover_days=RESTOCK_COVER_DAYS):
+    # Days the stock lasts at the forecast demand (inf if none is expected)
+    # and the whole units to order to cover cover_days of it
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_cover = np.where(daily_demand > 0, quantity_left / daily_demand, np.inf)
+    reorder = np.maximum(np.round(daily_demand * cover_days - quantity_left), 0)
+    return days_of_cover, reorder
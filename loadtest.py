@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pyarrow as pa
+import sqlalchemy
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+import rollups
+from db import database_url
+from migrate import migrate
+from offline import DEFAULT_SOURCE
+
+logger = logging.getLogger(__name__)
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+# Seconds to wait for the server to come up, and for any one script run
+STARTUP_TIMEOUT = 60
+RUN_TIMEOUT = 5 * 60
+# The dump creates the tablefunc extension, which the dashboard does not use
+# and not every Postgres install ships
+IGNORABLE_RESTORE_ERRORS = ['extension "tablefunc"']
+
+
+def restore(engine, dump=DEFAULT_SOURCE):
+    # Seeds the database from the demo dump, replacing what is there
+    pg_restore = shutil.which("pg_restore")
+    if pg_restore is None:
+        raise RuntimeError("pg_restore is needed to seed the database from the dump")
+    url = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    # --clean only drops what the dump holds; the migration indexes, their
+    # schema_migrations record and the rollups go with the schema, so all of
+    # them are rebuilt below
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("DROP SCHEMA IF EXISTS webshop CASCADE"))
+    restored = subprocess.run(
+        [pg_restore, "--clean", "--if-exists", "--no-owner", "--no-privileges", f"--dbname={url}", dump],
+        capture_output=True,
+        text=True,
+    )
+    errors = [
+        line
+        for line in restored.stderr.splitlines()
+        if line.startswith("pg_restore: error:") and not any(e in line for e in IGNORABLE_RESTORE_ERRORS)
+    ]
+    # Errors pg_restore skipped past are summed up as "errors ignored";
+    # without that line it gave up, e.g. on a bad URL or dump
+    if restored.returncode and (errors or "errors ignored on restore" not in restored.stderr):
+        raise RuntimeError(f"pg_restore failed:\n{restored.stderr}")
+    migrate(engine)
+    rollups.refresh(engine, full=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, env):
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", APP,
+            "--server.headless", "true",
+            "--server.port", str(port),
+            "--browser.gatherUsageStats", "false",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return server
+
+
+async def wait_until_healthy(port):
+    client = AsyncHTTPClient()
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            await client.fetch(f"http://127.0.0.1:{port}/_stcore/health")
+            return
+        except Exception:
+            await asyncio.sleep(0.5)
+    raise RuntimeError("the Streamlit server did not come up")
+
+
+def peak_rss_mb(pid):
+    # High-water mark of the server's resident memory, from the kernel (Linux)
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Session:
+    # One browser tab: a websocket speaking Streamlit's protocol, keeping the
+    # widget states a browser would send back with every rerun
+    def __init__(self, port):
+        self.port = port
+        self.widgets = {}
+        self.radio = None
+        self.editors = {}
+        self.errors = []
+
+    async def connect(self):
+        self.ws = await websocket_connect(
+            f"ws://127.0.0.1:{self.port}/_stcore/stream", subprotocols=["streamlit"]
+        )
+
+    async def rerun(self, fragment_id=""):
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.fragment_id = fragment_id
+        msg.rerun_script.widget_states.widgets.extend(self.widgets.values())
+        start = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        while True:
+            payload = await asyncio.wait_for(self.ws.read_message(), RUN_TIMEOUT)
+            if payload is None:
+                raise RuntimeError("the server closed the session")
+            forward = ForwardMsg()
+            forward.ParseFromString(payload)
+            kind = forward.WhichOneof("type")
+            if kind == "delta":
+                self._element(forward.delta)
+            elif kind == "script_finished":
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return (time.perf_counter() - start) * 1000
+
+    def _element(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors.append(element.exception.message)
+        elif kind == "radio":
+            self.radio = element.radio
+        elif kind == "arrow_data_frame" and element.arrow_data_frame.id:
+            editor = element.arrow_data_frame
+            if editor.id not in self.editors:
+                frame = pa.ipc.open_stream(editor.data).read_pandas()
+                checkbox = next(column for column in frame.columns if frame[column].dtype == bool)
+                self.editors[editor.id] = {
+                    "fragment_id": delta.fragment_id,
+                    "column": checkbox,
+                    "rows": len(frame),
+                    "edited": {},
+                }
+
+    def select(self, option):
+        state = WidgetState(id=self.radio.id, int_value=list(self.radio.options).index(option))
+        self.widgets[self.radio.id] = state
+        # Editors belong to the section they were drawn in
+        self.editors = {}
+
+    def toggle(self, rng):
+        # Flips one checkbox of a random filter editor; returns its fragment
+        editor_id, editor = rng.choice(sorted(self.editors.items()))
+        row = str(rng.randrange(editor["rows"]))
+        column = editor["column"]
+        current = editor["edited"].get(row, {}).get(column, True)
+        editor["edited"][row] = {column: not current}
+        value = {"edited_rows": editor["edited"], "added_rows": [], "deleted_rows": []}
+        self.widgets[editor_id] = WidgetState(id=editor_id, string_value=json.dumps(value))
+        return editor["fragment_id"]
+
+    def close(self):
+        self.ws.close()
+
+
+async def run_session(port, toggles, sections, rng, timings):
+    # Opens the dashboard, then in each section with filter editors toggles
+    # them a few times, the way a manager narrows down a table
+    session = Session(port)
+    await session.connect()
+    try:
+        timings["load"].append(await session.rerun())
+        for section in sections:
+            if section != session.radio.options[session.radio.default]:
+                session.select(section)
+                timings["section"].append(await session.rerun())
+            for _ in range(toggles if session.editors else 0):
+                fragment_id = session.toggle(rng)
+                timings["toggle"].append(await session.rerun(fragment_id))
+    finally:
+        session.close()
+    return session.errors
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {"n": len(values), "p50": at(50), "p95": at(95), "p99": at(99), "max": ordered[-1]}
+
+
+def pool_waits(profile_log):
+    waits = []
+    with open(profile_log, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("event") == "query" and record.get("pool_wait_ms") is not None:
+                waits.append(record["pool_wait_ms"])
+    return waits
+
+
+async def load_test(port, sessions, toggles, sections, seed):
+    timings = {"load": [], "section": [], "toggle": []}
+    results = await asyncio.gather(
+        *[
+            run_session(port, toggles, sections, random.Random(seed * 100_000 + number), timings)
+            for number in range(sessions)
+        ],
+        return_exceptions=True,
+    )
+    errors = []
+    for result in results:
+        errors.extend([repr(result)] if isinstance(result, BaseException) else result)
+    return timings, errors
+
+
+def report(sessions, timings, waits, rss_mb, errors):
+    lines = [
+        f"## {sessions} concurrent sessions",
+        "",
+        "| run | n | p50 ms | p95 ms | p99 ms | max ms |",
+        "|---|---|---|---|---|---|",
+    ]
+    for kind, values in timings.items():
+        stats = percentiles(values)
+        if stats:
+            lines.append(
+                f"| {kind} | {stats['n']} | {stats['p50']:.0f} | {stats['p95']:.0f} "
+                f"| {stats['p99']:.0f} | {stats['max']:.0f} |"
+            )
+    stats = percentiles(waits)
+    if stats:
+        lines.append(
+            f"| pool wait | {stats['n']} | {stats['p50']:.1f} | {stats['p95']:.1f} "
+            f"| {stats['p99']:.1f} | {stats['max']:.1f} |"
+        )
+    lines += ["", f"Peak server RSS: {rss_mb:.0f} MB" if rss_mb else "Peak server RSS: unknown"]
+    if errors:
+        lines += ["", f"{len(errors)} errors, e.g. {errors[0]}"]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive N concurrent dashboard sessions against a local Streamlit server"
+    )
+    parser.add_argument("sessions", nargs="*", type=int, default=[1, 5, 10, 25], help="session counts to try")
+    parser.add_argument("--toggles", type=int, default=5, help="filter toggles per section")
+    parser.add_argument("--sections", nargs="+", default=["Categories", "Stock"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--restore", action="store_true", help="seed DATABASE_URL from db_dump/mydb.dump first")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    engine = sqlalchemy.create_engine(database_url())
+    if args.restore:
+        restore(engine)
+
+    for sessions in args.sessions:
+        # A fresh server per session count, so caches start cold and the
+        # peak RSS is that of this load alone
+        with tempfile.NamedTemporaryFile(suffix=".jsonl") as profile_log:
+            env = dict(
+                os.environ,
+                DATABASE_URL=engine.url.render_as_string(hide_password=False),
+                WEBSHOP_PROFILE_LOG=profile_log.name,
+            )
+            port = free_port()
+            server = start_server(port, env)
+            try:
+                asyncio.run(wait_until_healthy(port))
+                timings, errors = asyncio.run(
+                    load_test(port, sessions, args.toggles, args.sections, args.seed)
+                )
+                rss_mb = peak_rss_mb(server.pid)
+            finally:
+                server.terminate()
+                server.wait()
+            print(report(sessions, timings, pool_waits(profile_log.name), rss_mb, errors))
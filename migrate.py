@@ -0,0 +1,85 @@
+import logging
+import os
+import re
+
+import sqlalchemy
+from sqlalchemy import text
+
+from db import database_url
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+_MIGRATION_FILE = re.compile(r"^(\d+)_.*\.sql$")
+# Statements are separated by a semicolon at the end of a line
+_STATEMENT_END = re.compile(r";\s*$", re.MULTILINE)
+_CREATE_INDEX = re.compile(r"CREATE\s+INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+# A failed or cancelled CREATE INDEX CONCURRENTLY leaves the index behind,
+# marked invalid: the planner never uses it and IF NOT EXISTS skips it
+INVALID_INDEX = """SELECT 1
+    FROM pg_index AS i
+    JOIN pg_class AS c ON c.oid = i.indexrelid
+    JOIN pg_namespace AS n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'webshop' AND c.relname = :name AND NOT i.indisvalid"""
+
+
+def migrations():
+    # (version, path) of every migration file, in order
+    found = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_FILE.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(MIGRATIONS_DIR, name)))
+    return sorted(found)
+
+
+def statements(path):
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    for statement in _STATEMENT_END.split(sql):
+        lines = [line for line in statement.splitlines() if not line.lstrip().startswith("--")]
+        if "".join(lines).strip():
+            yield "\n".join(lines).strip()
+
+
+def migrate(engine):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, so every
+    # statement is committed on its own. A migration is safe to re-run after
+    # a partial failure: IF NOT EXISTS skips the indexes already built, and
+    # an invalid one left by the failed build is dropped and built again.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS webshop.schema_migrations (
+                    version integer PRIMARY KEY,
+                    applied_at timestamp with time zone NOT NULL DEFAULT now()
+                )"""
+            )
+        )
+        applied = set(
+            connection.execute(text("SELECT version FROM webshop.schema_migrations")).scalars()
+        )
+        pending = [(version, path) for version, path in migrations() if version not in applied]
+        for version, path in pending:
+            logger.info("applying %s", os.path.basename(path))
+            for statement in statements(path):
+                index = _CREATE_INDEX.match(statement)
+                if index and connection.execute(text(INVALID_INDEX), {"name": index.group(1)}).first():
+                    logger.warning("dropping invalid index %s left by an earlier build", index.group(1))
+                    connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS webshop.{index.group(1)}"))
+                connection.execute(text(statement))
+            connection.execute(
+                text("INSERT INTO webshop.schema_migrations (version) VALUES (:version)"),
+                {"version": version},
+            )
+        if pending:
+            # Fresh statistics so the planner considers the new indexes
+            connection.execute(text("ANALYZE"))
+    return [version for version, _ in pending]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate(sqlalchemy.create_engine(database_url()))
@@ -0,0 +1,15 @@
+-- Foreign-key columns the dashboard joins on. The order-line indexes cover
+-- the columns the sales aggregations read, so those joins can be answered
+-- with index-only scans.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_positions_orderid_idx
+    ON webshop.order_positions (orderid) INCLUDE (articleid, amount, price);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_positions_articleid_idx
+    ON webshop.order_positions (articleid) INCLUDE (amount);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_customer_idx
+    ON webshop."order" (customer) INCLUDE (id, total);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS articles_productid_idx
+    ON webshop.articles (productid);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS stock_articleid_idx
+    ON webshop.stock (articleid);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS address_customerid_idx
+    ON webshop.address (customerid);
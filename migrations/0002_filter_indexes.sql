@@ -0,0 +1,12 @@
+-- Low-stock lookups only ever ask for nearly sold-out articles.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS stock_low_count_idx
+    ON webshop.stock (articleid) INCLUDE (count) WHERE count < 2;
+-- Orders are appended roughly in time order, so a BRIN index prunes date
+-- ranges for a few pages of index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_ordertimestamp_brin
+    ON webshop."order" USING brin (ordertimestamp);
+-- Rows written since the last rollup watermark (see rollups.py).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_changed_idx
+    ON webshop."order" ((GREATEST(created, updated)));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_positions_changed_idx
+    ON webshop.order_positions ((GREATEST(created, updated)));
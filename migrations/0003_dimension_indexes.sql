@@ -0,0 +1,5 @@
+-- The category list skips through this index one category at a time (see
+-- dimensions.py) instead of reading every product; category filters on
+-- products use it too.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_category_idx
+    ON webshop.products (category);
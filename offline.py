@@ -0,0 +1,248 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+
+import pandas as pd
+
+from rollups import DDL as ROLLUP_DDL
+from rollups import ROLLUPS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_dump", "mydb.dump")
+
+# webshop schema as DuckDB types; money becomes DECIMAL, enums and ranges text
+TABLES = {
+    "address": {
+        "id": "INTEGER", "customerid": "INTEGER", "firstname": "VARCHAR", "lastname": "VARCHAR",
+        "address1": "VARCHAR", "address2": "VARCHAR", "city": "VARCHAR", "zip": "VARCHAR",
+        "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+    "articles": {
+        "id": "INTEGER", "productid": "INTEGER", "ean": "VARCHAR", "colorid": "INTEGER",
+        "size": "INTEGER", "description": "VARCHAR", "originalprice": "MONEY", "reducedprice": "MONEY",
+        "taxrate": "DECIMAL(10,4)", "discountinpercent": "INTEGER", "currentlyactive": "BOOLEAN",
+        "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+    "colors": {"id": "INTEGER", "name": "VARCHAR", "rgb": "VARCHAR"},
+    "customer": {
+        "id": "INTEGER", "firstname": "VARCHAR", "lastname": "VARCHAR", "gender": "VARCHAR",
+        "email": "VARCHAR", "dateofbirth": "DATE", "currentaddressid": "INTEGER",
+        "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+    "labels": {"id": "INTEGER", "name": "VARCHAR", "slugname": "VARCHAR", "icon": "VARCHAR"},
+    "order": {
+        "id": "INTEGER", "customer": "INTEGER", "ordertimestamp": "TIMESTAMPTZ",
+        "shippingaddressid": "INTEGER", "total": "MONEY", "shippingcost": "MONEY",
+        "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+    "order_positions": {
+        "id": "INTEGER", "orderid": "INTEGER", "articleid": "INTEGER", "amount": "SMALLINT",
+        "price": "MONEY", "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+    "products": {
+        "id": "INTEGER", "name": "VARCHAR", "labelid": "INTEGER", "category": "VARCHAR",
+        "gender": "VARCHAR", "currentlyactive": "BOOLEAN", "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+    "sizes": {
+        "id": "INTEGER", "gender": "VARCHAR", "category": "VARCHAR", "size": "VARCHAR",
+        "size_us": "VARCHAR", "size_uk": "VARCHAR", "size_eu": "VARCHAR",
+    },
+    "stock": {
+        "id": "INTEGER", "articleid": "INTEGER", "count": "INTEGER",
+        "created": "TIMESTAMPTZ", "updated": "TIMESTAMPTZ",
+    },
+}
+
+# Postgres functions the dashboard SQL uses that DuckDB spells differently
+MACROS = """
+CREATE MACRO to_char(value, fmt) AS
+    strftime(value, replace(replace(replace(fmt, 'YYYY', '%Y'), 'MM', '%m'), 'DD', '%d'));
+"""
+
+_COPY_HEADER = re.compile(r"^COPY webshop\.\"?(\w+)\"? \((.*)\) FROM stdin;$")
+_ORDER_TABLE = re.compile(r"\bwebshop\.order\b(?!_)")
+_BIND_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+_COPY_ESCAPES = re.compile(r"\\(.)")
+_COPY_ESCAPE_MAP = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", "v": "\v"}
+
+
+def translate(sql):
+    # "order" is reserved in DuckDB and SQLAlchemy-style :name binds become $name
+    return _BIND_PARAM.sub(r"$\1", _ORDER_TABLE.sub('webshop."order"', sql))
+
+
+def _column_type(column_type):
+    return "DECIMAL(18,2)" if column_type == "MONEY" else column_type
+
+
+def _cast(column, column_type):
+    if column_type == "MONEY":
+        # COPY writes money in the dump's locale, e.g. "$1,234.56"
+        return f"""CAST(regexp_replace("{column}", '[^0-9.-]', '', 'g') AS DECIMAL(18,2)) AS "{column}\""""
+    return f'CAST("{column}" AS {column_type}) AS "{column}"'
+
+
+def _unescape(field):
+    if field == "\\N":
+        return None
+    if "\\" not in field:
+        return field
+    return _COPY_ESCAPES.sub(lambda m: _COPY_ESCAPE_MAP.get(m.group(1), m.group(1)), field)
+
+
+def read_dump(path):
+    # Yields (table, DataFrame of text columns) for every webshop COPY block of
+    # a pg_dump archive; needs the pg_restore client binary, not a server
+    pg_restore = shutil.which("pg_restore")
+    if pg_restore is None:
+        raise RuntimeError(
+            "pg_restore is needed to read a pg_dump archive; "
+            "export the schema to Parquet once (python offline.py export DIR) and load that instead"
+        )
+    process = subprocess.Popen(
+        [pg_restore, "--data-only", "--schema=webshop", "--file=-", path],
+        stdout=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+    )
+    table, columns, rows = None, None, []
+    for line in process.stdout:
+        line = line.rstrip("\n")
+        if table is None:
+            match = _COPY_HEADER.match(line)
+            if match:
+                table = match.group(1)
+                columns = [column.strip().strip('"') for column in match.group(2).split(",")]
+                rows = []
+        elif line == "\\.":
+            yield table, pd.DataFrame(rows, columns=columns, dtype=object)
+            table = None
+        else:
+            rows.append([_unescape(field) for field in line.split("\t")])
+    if process.wait() != 0:
+        raise RuntimeError(f"pg_restore failed on {path}")
+
+
+def _create_tables(con):
+    con.execute("CREATE SCHEMA IF NOT EXISTS webshop")
+    for table, columns in TABLES.items():
+        definition = ", ".join(f'"{column}" {_column_type(t)}' for column, t in columns.items())
+        con.execute(f'CREATE TABLE webshop."{table}" ({definition})')
+
+
+def _load_dump(con, path):
+    _create_tables(con)
+    for table, frame in read_dump(path):
+        if table not in TABLES:
+            continue
+        types = TABLES[table]
+        select = ", ".join(_cast(column, types.get(column, "VARCHAR")) for column in frame.columns)
+        names = ", ".join(f'"{column}"' for column in frame.columns)
+        con.register("copy_rows", frame)
+        con.execute(f'INSERT INTO webshop."{table}" ({names}) SELECT {select} FROM copy_rows')
+        con.unregister("copy_rows")
+
+
+def _load_parquet(con, directory):
+    con.execute("CREATE SCHEMA IF NOT EXISTS webshop")
+    for table in TABLES:
+        path = os.path.join(directory, f"{table}.parquet").replace("'", "''")
+        con.execute(f'CREATE TABLE webshop."{table}" AS SELECT * FROM read_parquet(\'{path}\')')
+
+
+def _build_rollups(con):
+    con.execute(ROLLUP_DDL)
+    for insert in ROLLUPS.values():
+        con.execute(translate(insert.format(where="o.ordertimestamp IS NOT NULL")))
+
+
+def load(source=DEFAULT_SOURCE):
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute(MACROS)
+    if os.path.isdir(source):
+        _load_parquet(con, source)
+    else:
+        _load_dump(con, source)
+    _build_rollups(con)
+    logger.info("loaded webshop schema from %s into DuckDB", source)
+    return con
+
+
+class DuckDBConnection:
+    # Stand-in for the st.connection SQL connection: same query() signature,
+    # answered from an in-process DuckDB copy of the webshop schema
+    def __init__(self, con, version):
+        self._con = con
+        self._version = version
+
+    def data_version(self):
+        return self._version
+
+    def query(self, sql, params=None, **kwargs):
+        # A cursor per call gives every thread its own DuckDB connection
+        cursor = self._con.cursor()
+        try:
+            # Fold unquoted identifiers to lower case as Postgres does
+            cursor.execute("SET preserve_identifier_case = false")
+            if params:
+                return cursor.execute(translate(sql), params).df()
+            return cursor.execute(translate(sql)).df()
+        finally:
+            cursor.close()
+
+    def stream(self, sql, params=None, chunk_rows=50_000, **kwargs):
+        # DuckDB hands results over as Arrow record batches of chunk_rows rows
+        cursor = self._con.cursor()
+        try:
+            cursor.execute("SET preserve_identifier_case = false")
+            if params:
+                cursor.execute(translate(sql), params)
+            else:
+                cursor.execute(translate(sql))
+            reader = cursor.fetch_record_batch(chunk_rows)
+            empty = True
+            for batch in reader:
+                empty = False
+                yield batch.to_pandas()
+            if empty:
+                yield reader.schema.empty_table().to_pandas()
+        finally:
+            cursor.close()
+
+    def estimate_rows(self, sql, params=None):
+        # Counting in process is cheap enough to stand in for an estimate
+        return int(self.query(f"SELECT COUNT(*) AS n FROM ({sql}) AS counted", params)["n"].iloc[0])
+
+    def explain(self, sql, params=None):
+        # DuckDB's EXPLAIN ANALYZE renders its plan as text
+        plan = self.query(f"EXPLAIN ANALYZE {sql}", params)
+        return plan["explain_value"].iloc[0]
+
+
+def connect(source=None):
+    source = source or DEFAULT_SOURCE
+    return DuckDBConnection(load(source), f"duckdb:{source}@{os.path.getmtime(source)}")
+
+
+def export(directory, source=DEFAULT_SOURCE):
+    con = load(source)
+    os.makedirs(directory, exist_ok=True)
+    for table in TABLES:
+        path = os.path.join(directory, f"{table}.parquet").replace("'", "''")
+        con.execute(f"COPY webshop.\"{table}\" TO '{path}' (FORMAT parquet)")
+    logger.info("exported webshop schema to %s", directory)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) >= 3 and sys.argv[1] == "export":
+        export(sys.argv[2], *sys.argv[3:4])
+    else:
+        sys.exit("usage: python offline.py export DIR [DUMP]")
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import event
+
+# One JSON object per line: every query, fetch call, section render and
+# script run
+logger = logging.getLogger("webshop.profile")
+
+if os.environ.get("WEBSHOP_PROFILE_LOG"):
+    _handler = logging.FileHandler(os.environ["WEBSHOP_PROFILE_LOG"], encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# Name of the fetch function running on this thread, so its queries can be
+# attributed to it (prefetch threads run one fetch each)
+_local = threading.local()
+
+
+def result_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+
+def result_rows(value):
+    return len(value) if isinstance(value, pd.DataFrame) else None
+
+
+class Profile:
+    # Per script run: what every query, fetch call and section cost
+    def __init__(self, explain=False):
+        self.lock = threading.Lock()
+        self.explain = explain
+        self.queries = []
+        self.fetches = []
+        self.sections = []
+        self.waited = 0.0
+
+
+def begin_profile():
+    # The admin panel's checkbox applies from the next run on
+    st.session_state["profile"] = Profile(explain=bool(st.session_state.get("profile_explain")))
+
+
+def current_profile():
+    try:
+        return st.session_state.get("profile")
+    except Exception:
+        # No script run context (e.g. a background thread)
+        return None
+
+
+def _record(records, kind, fields):
+    profile = current_profile()
+    if profile is not None:
+        with profile.lock:
+            getattr(profile, records).append(fields)
+    logger.info(json.dumps({"event": kind, **fields}, default=str))
+
+
+def ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+class PoolStats:
+    # Process-wide checkout counters of one connection pool; waits are only
+    # known for checkouts made by a query (see query_started)
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.timeouts = 0
+
+    def checked_out(self, wait_ms):
+        with self.lock:
+            self.checkouts += 1
+            if wait_ms is not None:
+                self.waits += 1
+                self.wait_ms_total += wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def row(self):
+        with self.lock:
+            return {
+                "pool": self.name,
+                "size": self.pool.size(),
+                "checked_out": self.pool.checkedout(),
+                "overflow": max(0, self.pool.overflow()),
+                "checkouts": self.checkouts,
+                "mean_wait_ms": round(self.wait_ms_total / self.waits, 2) if self.waits else None,
+                "max_wait_ms": self.wait_ms_max,
+                "timeouts": self.timeouts,
+            }
+
+
+_pools = {}
+
+
+def watch_pool(engine, name="primary"):
+    # Pool checkouts happen on the querying thread, so the wait is the time
+    # from starting the query (see query_started) to getting a connection
+    stats = _pools[name] = PoolStats(name, engine.pool)
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        started = getattr(_local, "query_started", None)
+        wait_ms = None
+        if started is not None:
+            wait_ms = _local.pool_wait_ms = ms(started)
+            _local.query_started = None
+            logger.info(json.dumps({"event": "checkout", "pool": name, "wait_ms": wait_ms}))
+        stats.checked_out(wait_ms)
+
+    return stats
+
+
+def pool_timed_out(engine):
+    for stats in _pools.values():
+        if stats.pool is engine.pool:
+            stats.timed_out()
+
+
+def pool_stats():
+    return [stats.row() for stats in _pools.values()]
+
+
+# Process boot steps as measured by boot.py, in milliseconds
+_boot = {}
+
+
+def record_boot(step, seconds):
+    _boot[step] = round(seconds * 1000, 2)
+    logger.info(json.dumps({"event": "boot", "step": step, "ms": _boot[step]}))
+
+
+def boot_stats():
+    return [{"step": step, "ms": value} for step, value in _boot.items()]
+
+
+def query_started():
+    _local.query_started = time.perf_counter()
+    _local.pool_wait_ms = None
+
+
+def pool_wait_ms():
+    return getattr(_local, "pool_wait_ms", None)
+
+
+def record_query(sql, source, wall_ms, db_ms, result, plan=None, pool_wait=None, rows=None, nbytes=None):
+    # source: "db", "store" (result store), "in flight" (shared with a
+    # concurrent identical query), "run" (already fetched in this run) or
+    # "stream" (read in chunks; result is None and rows/nbytes are totals)
+    fields = {
+        "fetch": getattr(_local, "fetch", None),
+        "sql": sql,
+        "source": source,
+        "wall_ms": wall_ms,
+        "db_ms": db_ms,
+        "pool_wait_ms": pool_wait,
+        "rows": rows if result is None else result_rows(result),
+        "bytes": nbytes if result is None else result_size(result),
+    }
+    if plan is not None:
+        fields["plan"] = plan
+    _record("queries", "query", fields)
+
+
+@contextmanager
+def fetching(name):
+    outer = getattr(_local, "fetch", None)
+    _local.fetch = name
+    try:
+        yield
+    finally:
+        _local.fetch = outer
+
+
+def record_fetch(name, hit, wall_ms, result):
+    _record(
+        "fetches",
+        "fetch",
+        {
+            "fetch": name,
+            "cache_hit": hit,
+            "wall_ms": wall_ms,
+            "rows": result_rows(result),
+            "bytes": result_size(result),
+        },
+    )
+
+
+def record_run(sent, saved):
+    # A script run's totals from the query layer: queries sent to the
+    # database, and those answered by a result already in the run or in flight
+    logger.info(json.dumps({"event": "run", "queries_sent": sent, "round_trips_saved": saved}))
+
+
+def record_wait(seconds):
+    # Time the script spent blocked on prefetched results
+    profile = current_profile()
+    if profile is not None:
+        with profile.lock:
+            profile.waited += seconds
+
+
+@contextmanager
+def timed_section(name):
+    # Render time excludes waiting for query results, leaving the DataFrame
+    # work and chart building
+    profile = current_profile()
+    waited = profile.waited if profile is not None else 0.0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = ms(start)
+        wait = round(((profile.waited if profile is not None else 0.0) - waited) * 1000, 2)
+        _record(
+            "sections",
+            "section",
+            {"section": name, "total_ms": total, "query_wait_ms": wait, "render_ms": round(total - wait, 2)},
+        )
@@ -0,0 +1,655 @@
+import numpy as np
+import pandas as pd
+
+from cache import cached
+from decode import compact, compact_chunks
+from dimensions import get_dimensions
+from forecast import restock, smoothed_demand
+
+AGE_GROUPS = ["18-30", "31-40", "41-50", "51-65", "66+"]
+
+
+def _read(_conn, sql, prepare=None, params=None, **compact_args):
+    # Results with a row per order line, customer or article are streamed:
+    # each chunk is prepared and compacted as it arrives, so only one chunk
+    # is ever held as raw rows. The compacted frame goes to the result store,
+    # keyed by how it was prepared, and is read back from there when it can.
+    variant = (getattr(prepare, "__qualname__", None), sorted(compact_args.items()))
+    load = getattr(_conn, "load", None)
+    df = load(sql, params, variant) if load is not None else None
+    if df is not None:
+        return df
+    stream = getattr(_conn, "stream", None)
+    chunks = stream(sql, params) if stream is not None else [_conn.query(sql=sql, params=params)]
+    if prepare is not None:
+        chunks = (prepare(chunk) for chunk in chunks)
+    df = compact_chunks(chunks, **compact_args)
+    save = getattr(_conn, "save", None)
+    if save is not None:
+        save(sql, params, df, variant)
+    return df
+
+
+# First day of every month from the first order's to the last's
+@cached("sales")
+def fetch_order_months(_conn):
+    df = _conn.query(
+        sql="""SELECT MIN(ordertimestamp)::date AS first, MAX(ordertimestamp)::date AS last
+        FROM webshop.order"""
+    )
+    first, last = df.iloc[0]
+    if pd.isna(first):
+        return []
+    return list(pd.period_range(pd.Timestamp(first), pd.Timestamp(last), freq="M").to_timestamp().date)
+
+
+# First and last id of the orders placed in period
+@cached("sales")
+def fetch_order_id_range(_conn, period=None):
+    where, params = _period_where(_conn, period, lines=False)
+    df = _conn.query(
+        sql=f"""SELECT MIN(o.id) AS first, MAX(o.id) AS last
+        FROM webshop.order AS o
+        WHERE {_and(where)}""",
+        params=params,
+    )
+    return tuple(None if pd.isna(value) else int(value) for value in df.iloc[0])
+
+
+# Conditions limiting a query to orders placed in period, a (start, end)
+# pair of dates with end excluded; None is the whole history. Order lines
+# have no timestamp of their own: bounding their orderid by the period's
+# first and last order turns the full read of order_positions into a range
+# scan of order_positions_orderid_idx, as order ids grow with time.
+def _period_where(_conn, period, lines=True):
+    if period is None:
+        return [], {}
+    where = ["o.ordertimestamp >= CAST(:start AS timestamptz)", "o.ordertimestamp < CAST(:end AS timestamptz)"]
+    params = {"start": period[0], "end": period[1]}
+    if lines:
+        where.append("op.orderid BETWEEN :first_order AND :last_order")
+        params["first_order"], params["last_order"] = fetch_order_id_range(_conn, period)
+    return where, params
+
+
+# The same for a rollup, by its month or day column
+def _rollup_where(period, column="month"):
+    if period is None:
+        return [], {}
+    return [f"{column} >= :start", f"{column} < :end"], {"start": period[0], "end": period[1]}
+
+
+def _and(where):
+    return " AND ".join(where) if where else "TRUE"
+
+
+# One denormalized row per order line for the top-product and pricing
+# sections, with only the columns they read; the category, label and gender
+# charts read the rollups instead
+@cached("sales")
+def fetch_sales_facts(_conn, period=None):
+    where, params = _period_where(_conn, period)
+    return _read(
+        _conn,
+        f"""SELECT o.id AS order_id, TO_CHAR(o.ordertimestamp, 'YYYY-MM') AS date_of_sale,
+            op.amount, op.price::numeric::float8 AS price,
+            (CASE WHEN (a.originalprice - op.price)::numeric::int > 0 THEN 1 ELSE 0 END) AS disc_sale,
+            p.name, p.category
+        FROM webshop.order AS o
+        JOIN webshop.order_positions AS op ON o.id = op.orderid
+        JOIN webshop.articles AS a ON a.id = op.articleid
+        JOIN webshop.products AS p ON p.id = a.productid
+        WHERE {_and(where)}""",
+        params=params,
+        categories=["date_of_sale", "name", "category"],
+        money=["price"],
+    )
+
+
+# Category, label and gender charts read the monthly rollups kept by rollups.py
+@cached("rollups")
+def fetch_category_sales(_conn, period=None):
+    where, params = _rollup_where(period)
+    return _conn.query(
+        sql=f"""SELECT category, TO_CHAR(month, 'YYYY-MM') AS date_of_sale, number_of_sales, revenue::int AS revenue
+        FROM webshop.rollup_category_month
+        WHERE {_and(where)}
+        ORDER BY 1,2""",
+        params=params,
+    )
+
+
+@cached("rollups")
+def fetch_gender_sales(_conn, period=None):
+    where, params = _rollup_where(period)
+    return _conn.query(
+        sql=f"""SELECT gender, SUM(number_of_sales)::bigint AS count
+        FROM webshop.rollup_gender_month
+        WHERE {_and(where)}
+        GROUP BY 1""",
+        params=params,
+    )
+
+
+@cached("rollups")
+def fetch_label_sales(_conn, period=None):
+    where, params = _rollup_where(period)
+    df = _conn.query(
+        sql=f"""SELECT labelid, SUM(number_of_sales)::bigint AS count, SUM(revenue)::int AS revenue
+        FROM webshop.rollup_label_month
+        WHERE {_and(["labelid IS NOT NULL"] + where)}
+        GROUP BY labelid""",
+        params=params,
+    )
+    df.insert(0, "name", get_dimensions(_conn).decode("labels", df.pop("labelid")).astype(str))
+    df["revenue_distribution"] = np.select(
+        [
+            df["revenue"] > 10000,
+            df["revenue"].between(7000, 9999),
+            df["revenue"].between(4000, 6999),
+        ],
+        [
+            "More than $10,000",
+            "Between $7,000 and $10,000",
+            "Between $4,000 and $7,000",
+        ],
+        default="Less than $4,000",
+    )
+    return df
+
+
+@cached("sales")
+def fetch_pricing_categories(_conn, period=None):
+    df = (
+        fetch_sales_facts(_conn, period)
+        .groupby("category", observed=True)
+        .agg(count=("date_of_sale", "count"), sum=("disc_sale", "sum"))
+        .reset_index()
+    )
+    df["discounted_sales_percentage"] = (df["sum"] / df["count"] * 100).round(2)
+    return df.sort_values("discounted_sales_percentage", ascending=False)
+
+
+# One row per order: its items, its discounted items and its items in each
+# category, for whatever categories exist. One pass over the order lines:
+# the category counts are a single bincount over (order, category) codes.
+@cached("sales")
+def fetch_order_composition(_conn, period=None):
+    facts = fetch_sales_facts(_conn, period)
+    order_codes, order_ids = pd.factorize(facts["order_id"], sort=True)
+    categories = facts["category"].cat.categories
+    category_codes = facts["category"].cat.codes.to_numpy()
+    known = category_codes >= 0
+    items = np.bincount(
+        order_codes[known] * len(categories) + category_codes[known],
+        minlength=len(order_ids) * len(categories),
+    ).reshape(len(order_ids), len(categories))
+
+    df = pd.DataFrame(items.astype("int32"), columns=categories.astype(str))
+    df.insert(0, "order_id", order_ids)
+    df.insert(1, "number_of_items", np.bincount(order_codes, minlength=len(order_ids)).astype("int32"))
+    df.insert(
+        2,
+        "discounted_items",
+        np.bincount(order_codes, weights=facts["disc_sale"], minlength=len(order_ids)).astype("int32"),
+    )
+    df.insert(3, "discounted_sales_percentage", (df["discounted_items"] / df["number_of_items"] * 100).round(2))
+    return df
+
+
+# Per category: the orders of more than one item that contain it, and the
+# share of those with at least one discounted item
+@cached("sales")
+def fetch_basket_discounts(_conn, period=None):
+    orders = fetch_order_composition(_conn, period)
+    baskets = orders[orders["number_of_items"] > 1]
+    categories = baskets.columns[4:]
+    contains = baskets[categories].to_numpy() > 0
+    discounted = baskets["discounted_items"].to_numpy()[:, None] > 0
+    df = pd.DataFrame(
+        {
+            "category": categories,
+            "orders": contains.sum(axis=0),
+            "discounted_orders": (contains & discounted).sum(axis=0),
+        }
+    )
+    df["discounted_share"] = (df["discounted_orders"] / df["orders"] * 100).round(2)
+    return df.sort_values("discounted_share", ascending=False)
+
+
+# Order lines per product and day at full and at reduced price, read from
+# webshop.rollup_product_day. Products are counted by name, as the dashboard
+# lists them, and the names come from the dimension registry rather than a
+# join: the rollup rows arrive as four integers, the day counted from
+# 1970-01-01. Indexed by (product, day); the product level is categorical
+# over every product name, sold or not.
+@cached("rollups")
+def fetch_product_daily_sales(_conn, period=None):
+    dimensions = get_dimensions(_conn)
+    where, params = _rollup_where(period, "day")
+    df = _read(
+        _conn,
+        f"""SELECT productid, (day - DATE '1970-01-01')::int AS day, full_price_sales::int AS full_price_sales,
+            discounted_sales::int AS discounted_sales
+        FROM webshop.rollup_product_day
+        WHERE {_and(where)}""",
+        params=params,
+    )
+    df["product"] = dimensions.decode("products", df.pop("productid"))
+    df["day"] = pd.to_datetime(df["day"], unit="D")
+    df = df.groupby(["product", "day"], observed=True).sum().sort_index()
+    return df.astype("int32")
+
+
+PRICE_REDUCTION_EFFECTS = ["benefited", "no gain", "no full-price baseline", "discount only", "full price only", "unsold"]
+
+
+# Every product of a (product, day) daily series classified in one grouped
+# pass. A product sold both ways is split at its first discounted sale: it
+# benefited if it sold more per day from then on than at full price before.
+# That takes full-price sales on at least one day before the split; a
+# product discounted before it ever sold at full price has no baseline.
+def classify_price_reductions(series, start, end):
+    products = series.index.get_level_values("product").categories
+    series = series.reset_index()
+
+    # Each product's first day at a reduced price, NaT if it never had one
+    series["reduced_on"] = (
+        series["day"].where(series["discounted_sales"] > 0).groupby(series["product"], observed=True).transform("min")
+    )
+    sales = series["full_price_sales"] + series["discounted_sales"]
+    series["sales_before"] = sales.where(series["day"] < series["reduced_on"], 0)
+    series["sales_after"] = sales.where(series["day"] >= series["reduced_on"], 0)
+    df = series.groupby("product", observed=True).agg(
+        full_price_sales=("full_price_sales", "sum"),
+        discounted_sales=("discounted_sales", "sum"),
+        reduced_on=("reduced_on", "first"),
+        sales_before=("sales_before", "sum"),
+        sales_after=("sales_after", "sum"),
+    )
+    df = df.reindex(pd.CategoricalIndex(products, categories=products, name="product"))
+    df[["full_price_sales", "discounted_sales", "sales_before", "sales_after"]] = (
+        df[["full_price_sales", "discounted_sales", "sales_before", "sales_after"]].fillna(0).astype("int32")
+    )
+
+    days_before = (df["reduced_on"] - start).dt.days
+    days_after = (end - df["reduced_on"]).dt.days
+    df["sales_per_day_before"] = df["sales_before"] / days_before.where(days_before > 0)
+    df["sales_per_day_after"] = df["sales_after"] / days_after
+    full_price, discounted = df["full_price_sales"] > 0, df["discounted_sales"] > 0
+    baseline = (df["sales_before"] > 0) & (days_before > 0)
+    effect = np.select(
+        [
+            full_price & discounted & baseline & (df["sales_per_day_after"] > df["sales_per_day_before"]),
+            full_price & discounted & baseline,
+            full_price & discounted,
+            discounted,
+            full_price,
+        ],
+        PRICE_REDUCTION_EFFECTS[:5],
+        default="unsold",
+    )
+    df["effect"] = pd.Categorical(effect, categories=PRICE_REDUCTION_EFFECTS)
+    return df.reset_index()
+
+
+# Measured over the period, or the whole series without one
+@cached("rollups")
+def fetch_price_reduction_effect(_conn, period=None):
+    series = fetch_product_daily_sales(_conn, period)
+    days = series.index.get_level_values("day")
+    if period is None:
+        start, end = days.min(), days.max() + pd.Timedelta(days=1)
+    else:
+        start, end = pd.Timestamp(period[0]), pd.Timestamp(period[1])
+    return classify_price_reductions(series, start, end)
+
+
+@cached("sales")
+def fetch_top_products_data(_conn, period=None):
+    facts = fetch_sales_facts(_conn, period)
+    df = (
+        facts.assign(sales_volume=facts["amount"] * facts["price"])
+        .groupby(["name", "category"], as_index=False, observed=True)["sales_volume"]
+        .sum()
+        .rename(columns={"sales_volume": "Total sales volume"})
+    )
+    top_selling_items = df["Total sales volume"].rank(method="dense", ascending=False)
+    return df[top_selling_items <= 100].sort_values(
+        "Total sales volume", ascending=False, kind="stable"
+    )
+
+
+# Paged tables count their rows exactly up to this many, and above it take
+# the planner's estimate
+COUNT_LIMIT = 10_000
+
+
+def _count_rows(_conn, sql, params):
+    counted = _conn.query(
+        sql=f"""SELECT COUNT(*) AS n FROM ({sql} LIMIT {COUNT_LIMIT}) AS counted""",
+        params=params,
+    )
+    n = int(counted["n"].iloc[0])
+    return n if n < COUNT_LIMIT else max(n, _conn.estimate_rows(sql, params))
+
+
+# Top products with the category selection pushed into SQL, a page at a time.
+# The ranking still covers every category, as in fetch_top_products_data.
+TOP_PRODUCTS_SQL = """WITH volume AS (
+        SELECT p.name, p.category::text AS category,
+            SUM((op.amount * op.price)::numeric)::float8 AS sales_volume
+        FROM webshop.order_positions AS op
+        JOIN webshop.articles AS a ON a.id = op.articleid
+        JOIN webshop.products AS p ON p.id = a.productid
+        {orders}
+        GROUP BY p.name, p.category),
+    ranked AS (
+        SELECT name, category, sales_volume,
+            DENSE_RANK() OVER (ORDER BY sales_volume DESC) AS sales_rank
+        FROM volume)
+    SELECT name, category, sales_volume AS "Total sales volume"
+    FROM ranked
+    WHERE {where}"""
+
+
+# Orders in the period, joined to the order lines "op" of a query that does
+# not otherwise read webshop.order
+def _period_join(_conn, period):
+    where, params = _period_where(_conn, period)
+    if not where:
+        return "", params
+    return f"JOIN webshop.order AS o ON o.id = op.orderid WHERE {_and(where)}", params
+
+
+def _top_products_where(categories, after=None):
+    where = ["sales_rank <= 100"]
+    params = {}
+    if categories is not None:
+        where.append("category = ANY(:categories)")
+        params["categories"] = list(categories)
+    if after is not None:
+        # Keyset: rows after the last one shown, in (volume, name, category)
+        # order. Some names are sold in more than one category, so the name
+        # alone does not tell rows apart.
+        where.append(
+            """(sales_volume < :after_volume OR (sales_volume = :after_volume
+            AND (name < :after_name OR (name = :after_name AND category < :after_category))))"""
+        )
+        params["after_volume"], params["after_name"], params["after_category"] = after
+    return " AND ".join(where), params
+
+
+@cached("sales")
+def fetch_top_products_page(_conn, categories=None, after=None, page_size=50, period=None):
+    where, params = _top_products_where(categories, after)
+    orders, period_params = _period_join(_conn, period)
+    return compact(
+        _conn.query(
+            sql=TOP_PRODUCTS_SQL.format(where=where, orders=orders)
+            + """ ORDER BY sales_volume DESC, name DESC, category DESC LIMIT :page_size""",
+            params={**params, **period_params, "page_size": page_size},
+        ),
+        categories=["category"],
+    )
+
+
+@cached("sales")
+def fetch_top_products_count(_conn, categories=None, period=None):
+    where, params = _top_products_where(categories)
+    orders, period_params = _period_join(_conn, period)
+    return _count_rows(_conn, TOP_PRODUCTS_SQL.format(where=where, orders=orders), {**params, **period_params})
+
+
+# Low stock with the category and size selections pushed into SQL, a page at
+# a time in article order. Colors and sizes come back as ids, named from the
+# dimension registry.
+STOCK_SQL = """WITH low_stock AS
+        (SELECT st.articleid AS stock_article_id, st.count AS quantity_left, ar.colorid,
+            ar.size AS sizeid, p.name, p.category::text AS category
+        FROM webshop.stock AS st
+        JOIN webshop.articles AS ar ON st.articleid = ar.id
+        JOIN webshop.products AS p ON p.id = ar.productid
+        WHERE {where}),
+    popular_articles AS (
+        SELECT op.articleid AS order_article_id
+        FROM webshop.order_positions AS op
+        JOIN low_stock ON low_stock.stock_article_id = op.articleid
+        {orders}
+        GROUP BY 1
+        HAVING SUM(amount) > 1)
+    SELECT stock_article_id :: text AS stock_article_id, name, colorid, sizeid, category, quantity_left
+    FROM low_stock
+    JOIN popular_articles ON stock_article_id = order_article_id"""
+
+
+def _name_stock(dimensions, df):
+    df.insert(2, "color", dimensions.decode("colors", df.pop("colorid")))
+    df.insert(3, "size", dimensions.decode("sizes", df.pop("sizeid")))
+    return df
+
+
+def _stock_where(categories, size_ids, after=None):
+    where = ["st.count < 2"]
+    params = {}
+    if categories is not None:
+        where.append("p.category::text = ANY(:categories)")
+        params["categories"] = list(categories)
+    if size_ids is not None:
+        where.append("ar.size = ANY(:size_ids)")
+        params["size_ids"] = [int(size_id) for size_id in size_ids]
+    if after is not None:
+        where.append("st.articleid > :after_article_id")
+        params["after_article_id"] = int(after[0])
+    return " AND ".join(where), params
+
+
+@cached("stock")
+def fetch_stock_page(_conn, categories=None, size_ids=None, after=None, page_size=50, period=None):
+    where, params = _stock_where(categories, size_ids, after)
+    orders, period_params = _period_join(_conn, period)
+    df = _conn.query(
+        sql=STOCK_SQL.format(where=where, orders=orders)
+        + """ ORDER BY low_stock.stock_article_id LIMIT :page_size""",
+        params={**params, **period_params, "page_size": page_size},
+    )
+    return compact(_name_stock(get_dimensions(_conn), df), categories=["name", "category"])
+
+
+@cached("stock")
+def fetch_stock_count(_conn, categories=None, size_ids=None, period=None):
+    where, params = _stock_where(categories, size_ids)
+    orders, period_params = _period_join(_conn, period)
+    return _count_rows(_conn, STOCK_SQL.format(where=where, orders=orders), {**params, **period_params})
+
+
+def _age_groups(df):
+    df["age_group"] = np.select(
+        [
+            df["age"].between(18, 30),
+            df["age"].between(31, 40),
+            df["age"].between(41, 50),
+            df["age"].between(51, 65),
+            df["age"] > 65,
+        ],
+        AGE_GROUPS,
+        default="<18",
+    )
+    # Categories in string order, the order the age-group tables have always had
+    df["age_group"] = pd.Categorical(df["age_group"], categories=sorted(["<18"] + AGE_GROUPS))
+    return df
+
+
+# One row per customer (and city) with everything the customer section
+# charts need; they are all derived from it in pandas
+@cached("customers")
+def fetch_customer_frame(_conn, period=None):
+    where, params = _period_where(_conn, period)
+    return _read(
+        _conn,
+        f"""SELECT c.id AS customer_id, c.gender, EXTRACT(year FROM age(current_date, c.dateofbirth))::int AS age,
+            a.city, COUNT(DISTINCT o.id) AS number_of_orders, COUNT(op.id) AS number_of_products_bought,
+            SUM(o.total)::numeric::float8 AS money_total, SUM(o.total)::numeric::int AS money_spent,
+            (SUM(o.total)/COUNT(o.id))::numeric::int AS average_check,
+            AVG(COALESCE(ar.discountinpercent, 0))::float8 AS average_discount
+        FROM webshop.customer AS c LEFT JOIN webshop.address AS a ON c.id = a.customerid
+        JOIN webshop.order AS o ON o.customer = c.id
+        JOIN webshop.order_positions AS op ON op.orderid = o.id
+        JOIN webshop.articles AS ar ON op.articleid = ar.id
+        WHERE {_and(where)}
+        GROUP BY c.id, c.gender, c.dateofbirth, a.city""",
+        _age_groups,
+        params,
+        categories=["gender", "city"],
+        money=["money_total"],
+    )
+
+
+@cached("customers")
+def fetch_customers_gender(_conn, period=None):
+    return (
+        fetch_customer_frame(_conn, period)
+        .groupby("gender", dropna=False, observed=True)
+        .size()
+        .reset_index(name="number_of_customers_per_gender")
+        .sort_values("number_of_customers_per_gender", ascending=False)
+    )
+
+
+@cached("customers")
+def fetch_customers_age(_conn, period=None):
+    return (
+        fetch_customer_frame(_conn, period)
+        .groupby("age_group", observed=True)
+        .size()
+        # observed=True groups come in order of appearance
+        .sort_index()
+        .reset_index(name="Age group")
+    )
+
+
+@cached("customers")
+def fetch_age_group_summary(_conn, period=None):
+    return (
+        fetch_customer_frame(_conn, period)
+        .groupby("age_group", observed=True)
+        .agg(
+            number_of_customers_per_age_group=("customer_id", "count"),
+            average_number_of_orders_per_age_group=("number_of_orders", "mean"),
+            average_products_bought_per_age_group=("number_of_products_bought", "mean"),
+            average_money_spent_per_age_group=("money_spent", "mean"),
+            average_check_per_age_group=("average_check", "mean"),
+        )
+        .round(2)
+        .sort_index()
+        .reset_index()
+    )
+
+
+@cached("customers")
+def fetch_customers(_conn, period=None):
+    return fetch_customer_frame(_conn, period).sort_values(
+        ["money_total", "number_of_products_bought"], ascending=False
+    )[
+        [
+            "customer_id",
+            "gender",
+            "age",
+            "city",
+            "number_of_orders",
+            "number_of_products_bought",
+            "money_spent",
+            "average_check",
+        ]
+    ]
+
+
+# Recurring customers: more than one order line
+@cached("customers")
+def fetch_age_group_summary_short(_conn, period=None):
+    df = fetch_customer_frame(_conn, period)
+    df = df[df["number_of_products_bought"] > 1]
+    return (
+        df.assign(average_check=df["money_total"] / df["number_of_products_bought"])
+        .groupby("age_group", observed=True)
+        .agg(
+            average_check=("average_check", "mean"),
+            average_discount=("average_discount", "mean"),
+        )
+        .round(2)
+        .sort_index()
+        .reset_index()
+    )
+
+
+@cached("stock")
+def fetch_stock_data(_conn, period=None):
+    dimensions = get_dimensions(_conn)
+    orders, params = _period_join(_conn, period)
+    return _read(
+        _conn,
+        f"""
+    WITH low_stock AS 
+	    (Select st.articleid as stock_article_id, st.count as quantity_left, ar.colorid, ar.size as sizeid, p.name, p.category
+	    From webshop.stock as st
+        JOIN webshop.articles as ar ON st.articleid = ar.id
+        JOIN webshop.products as p ON p.id = ar.productid
+        WHERE st.count < 2),
+    popular_articles AS (
+        SELECT op.articleid order_article_id,SUM(amount)
+        FROM webshop.order_positions as op
+        {orders}
+        GROUP BY 1
+        HAVING SUM(amount) > 1)
+    SELECT stock_article_id :: text AS stock_article_id,name, colorid, sizeid, category, quantity_left
+    FROM low_stock
+    JOIN popular_articles ON stock_article_id = order_article_id""",
+        lambda df: _name_stock(dimensions, df),
+        params,
+        categories=["name", "category"],
+    )
+
+
+# Forecast weekly demand for every article from webshop.rollup_article_day,
+# all series smoothed together; weeks are counted back from the last day
+# with any sales
+@cached("rollups")
+def fetch_demand_forecast(_conn):
+    df = _read(
+        _conn,
+        """SELECT articleid, (day - DATE '1970-01-01')::int AS day, units::int AS units
+        FROM webshop.rollup_article_day""",
+    )
+    weeks_ago = (df["day"].max() - df["day"].to_numpy()) // 7
+    series, article_ids = pd.factorize(df["articleid"], sort=True)
+    weekly = smoothed_demand(
+        series,
+        weeks_ago,
+        df["units"].to_numpy(),
+        len(article_ids),
+        weeks_ago.max() + 1 if len(df.index) else 1,
+    )
+    return pd.DataFrame({"article_id": article_ids.astype("int32"), "daily_demand": weekly / 7})
+
+
+# Every article in stock with its forecast demand, the days its stock lasts
+# and the units to reorder, least cover first
+@cached("stock")
+def fetch_restock(_conn):
+    dimensions = get_dimensions(_conn)
+    df = _read(
+        _conn,
+        """SELECT st.articleid AS article_id, p.name, ar.colorid, ar.size AS sizeid,
+            p.category::text AS category, st.count AS quantity_left
+        FROM webshop.stock AS st
+        JOIN webshop.articles AS ar ON st.articleid = ar.id
+        JOIN webshop.products AS p ON p.id = ar.productid""",
+        lambda df: _name_stock(dimensions, df),
+        categories=["name", "category"],
+    )
+    df = df.merge(fetch_demand_forecast(_conn), on="article_id", how="left")
+    df["daily_demand"] = df["daily_demand"].fillna(0)
+    days_of_cover, reorder = restock(df["quantity_left"].to_numpy(), df["daily_demand"].to_numpy())
+    df["days_of_cover"] = days_of_cover
+    df["reorder_quantity"] = reorder.astype("int32")
+    return df.sort_values(["days_of_cover", "daily_demand"], ascending=[True, False], ignore_index=True)
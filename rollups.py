@@ -0,0 +1,178 @@
+import logging
+
+import sqlalchemy
+from sqlalchemy import text
+
+from db import database_url
+
+logger = logging.getLogger(__name__)
+
+# Orders written up to this long before the previous refresh started are
+# looked at again, so rows committed late by concurrent transactions are not
+# missed. Recomputing a month twice is harmless.
+LOOKBACK = "10 minutes"
+
+DDL = """
+CREATE TABLE IF NOT EXISTS webshop.rollup_category_month (
+    category text NOT NULL,
+    month date NOT NULL,
+    number_of_sales bigint NOT NULL,
+    revenue numeric NOT NULL,
+    PRIMARY KEY (category, month)
+);
+CREATE TABLE IF NOT EXISTS webshop.rollup_label_month (
+    labelid integer NOT NULL,
+    month date NOT NULL,
+    number_of_sales bigint NOT NULL,
+    revenue numeric NOT NULL,
+    PRIMARY KEY (labelid, month)
+);
+CREATE TABLE IF NOT EXISTS webshop.rollup_gender_month (
+    gender text NOT NULL,
+    month date NOT NULL,
+    number_of_sales bigint NOT NULL,
+    PRIMARY KEY (gender, month)
+);
+CREATE TABLE IF NOT EXISTS webshop.rollup_product_day (
+    productid integer NOT NULL,
+    day date NOT NULL,
+    full_price_sales bigint NOT NULL,
+    discounted_sales bigint NOT NULL,
+    PRIMARY KEY (productid, day)
+);
+-- Date-range filters read a few days of the daily rollups, not all of them
+CREATE INDEX IF NOT EXISTS rollup_product_day_day_idx ON webshop.rollup_product_day (day);
+CREATE TABLE IF NOT EXISTS webshop.rollup_article_day (
+    articleid integer NOT NULL,
+    day date NOT NULL,
+    units bigint NOT NULL,
+    PRIMARY KEY (articleid, day)
+);
+CREATE TABLE IF NOT EXISTS webshop.rollup_watermark (
+    name text PRIMARY KEY,
+    refreshed_at timestamp with time zone NOT NULL
+);
+"""
+
+ORDER_LINES = """
+    FROM webshop.order AS o
+    JOIN webshop.order_positions AS op ON o.id = op.orderid
+    JOIN webshop.articles AS a ON a.id = op.articleid
+    JOIN webshop.products AS p ON p.id = a.productid"""
+
+# Order lines of the months being recomputed; :lo/:hi let the planner use a
+# range scan on ordertimestamp before the exact month filter
+MONTHS_FILTER = """o.ordertimestamp >= :lo AND o.ordertimestamp < :hi
+        AND date_trunc('month', o.ordertimestamp)::date = ANY(:months)"""
+
+# INSERT statements per rollup table, formatted with the order-line filter
+ROLLUPS = {
+    "webshop.rollup_category_month": f"""
+    INSERT INTO webshop.rollup_category_month (category, month, number_of_sales, revenue)
+    SELECT p.category::text, date_trunc('month', o.ordertimestamp)::date,
+        COUNT(o.ordertimestamp), SUM(o.total::numeric)
+    {ORDER_LINES}
+    WHERE {{where}} AND p.category IS NOT NULL
+    GROUP BY 1,2""",
+    "webshop.rollup_label_month": f"""
+    INSERT INTO webshop.rollup_label_month (labelid, month, number_of_sales, revenue)
+    SELECT p.labelid, date_trunc('month', o.ordertimestamp)::date,
+        COUNT(o.ordertimestamp), SUM(o.total::numeric)
+    {ORDER_LINES}
+    WHERE {{where}} AND p.labelid IS NOT NULL
+    GROUP BY 1,2""",
+    "webshop.rollup_gender_month": f"""
+    INSERT INTO webshop.rollup_gender_month (gender, month, number_of_sales)
+    SELECT p.gender::text, date_trunc('month', o.ordertimestamp)::date, COUNT(o.id)
+    {ORDER_LINES}
+    WHERE {{where}} AND p.gender IS NOT NULL
+    GROUP BY 1,2""",
+    "webshop.rollup_product_day": f"""
+    INSERT INTO webshop.rollup_product_day (productid, day, full_price_sales, discounted_sales)
+    SELECT p.id, date_trunc('day', o.ordertimestamp)::date,
+        SUM(CASE WHEN (a.originalprice - op.price)::numeric::int > 0 THEN 0 ELSE 1 END),
+        SUM(CASE WHEN (a.originalprice - op.price)::numeric::int > 0 THEN 1 ELSE 0 END)
+    {ORDER_LINES}
+    WHERE {{where}}
+    GROUP BY 1,2""",
+    "webshop.rollup_article_day": """
+    INSERT INTO webshop.rollup_article_day (articleid, day, units)
+    SELECT op.articleid, date_trunc('day', o.ordertimestamp)::date, SUM(op.amount)
+    FROM webshop.order AS o
+    JOIN webshop.order_positions AS op ON o.id = op.orderid
+    WHERE {where} AND op.articleid IS NOT NULL
+    GROUP BY 1,2""",
+}
+
+# Rollups kept per day rather than per month, by the expression that gives
+# a row's month
+MONTH_OF = {
+    "webshop.rollup_product_day": "date_trunc('month', day)::date",
+    "webshop.rollup_article_day": "date_trunc('month', day)::date",
+}
+
+ALL_MONTHS = """
+    SELECT DISTINCT date_trunc('month', ordertimestamp)::date
+    FROM webshop.order
+    WHERE ordertimestamp IS NOT NULL"""
+
+# Months touched by orders or order lines written since the last watermark.
+# An order moved to another month only refreshes its new month; run with
+# full=True after such corrections.
+CHANGED_MONTHS = """
+    SELECT date_trunc('month', o.ordertimestamp)::date
+    FROM webshop.order AS o
+    WHERE GREATEST(o.created, o.updated) > CAST(:watermark AS timestamptz) - CAST(:lookback AS interval)
+    UNION
+    SELECT date_trunc('month', o.ordertimestamp)::date
+    FROM webshop.order_positions AS op
+    JOIN webshop.order AS o ON o.id = op.orderid
+    WHERE GREATEST(op.created, op.updated) > CAST(:watermark AS timestamptz) - CAST(:lookback AS interval)"""
+
+
+def refresh(engine, full=False):
+    with engine.begin() as connection:
+        connection.execute(text(DDL))
+        # Serialize concurrent refresh jobs
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('webshop.rollups'))"))
+        started = connection.execute(text("SELECT now()")).scalar()
+
+        watermark = connection.execute(
+            text("SELECT refreshed_at FROM webshop.rollup_watermark WHERE name = 'sales'")
+        ).scalar()
+        if full or watermark is None:
+            months = connection.execute(text(ALL_MONTHS)).scalars().all()
+        else:
+            months = connection.execute(
+                text(CHANGED_MONTHS), {"watermark": watermark, "lookback": LOOKBACK}
+            ).scalars().all()
+        months = sorted(month for month in months if month is not None)
+
+        if months:
+            bounds = connection.execute(
+                text("SELECT CAST(:lo AS timestamptz), CAST(:hi AS timestamptz) + interval '1 month'"),
+                {"lo": months[0], "hi": months[-1]},
+            ).one()
+            params = {"months": months, "lo": bounds[0], "hi": bounds[1]}
+            for table, insert in ROLLUPS.items():
+                month = MONTH_OF.get(table, "month")
+                connection.execute(text(f"DELETE FROM {table} WHERE {month} = ANY(:months)"), params)
+                connection.execute(text(insert.format(where=MONTHS_FILTER)), params)
+
+        connection.execute(
+            text(
+                """INSERT INTO webshop.rollup_watermark (name, refreshed_at) VALUES ('sales', :started)
+                ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at"""
+            ),
+            {"started": started},
+        )
+
+    logger.info("rollups refreshed for %d month(s)", len(months))
+    return months
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    refresh(sqlalchemy.create_engine(database_url()), full="--full" in sys.argv)
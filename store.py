@@ -0,0 +1,68 @@
+import logging
+import os
+import time
+import uuid
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Local files not read or written for this long are removed on startup
+MAX_AGE_DAYS = 7
+
+
+class ResultStore:
+    # Query results as Arrow IPC (Feather) files shared by every process that
+    # points at the same location: a local or mounted directory, or an fsspec
+    # URL such as s3://bucket/prefix (e.g. a local MinIO; needs fsspec/s3fs)
+    def __init__(self, location):
+        if "://" in location:
+            import fsspec
+
+            self._fs, self._root = fsspec.core.url_to_fs(location)
+            self._fs.makedirs(self._root, exist_ok=True)
+        else:
+            self._fs, self._root = None, location
+            os.makedirs(location, exist_ok=True)
+            self.prune()
+
+    def _path(self, key):
+        return f"{self._root.rstrip('/')}/{key}.arrow"
+
+    def _open(self, path, mode):
+        return open(path, mode) if self._fs is None else self._fs.open(path, mode)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with self._open(path, "rb") as f:
+                df = pd.read_feather(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("unreadable result file %s", path, exc_info=True)
+            return None
+        if self._fs is None:
+            os.utime(path)
+        return df
+
+    def put(self, key, df):
+        path = self._path(key)
+        # Written under a temporary name and renamed, so readers in other
+        # processes never see a partial file
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with self._open(tmp, "wb") as f:
+                df.reset_index(drop=True).to_feather(f)
+            if self._fs is None:
+                os.replace(tmp, path)
+            else:
+                self._fs.mv(tmp, path)
+        except Exception:
+            logger.warning("could not store result file %s", path, exc_info=True)
+
+    def prune(self, max_age_days=MAX_AGE_DAYS):
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+        for entry in os.scandir(self._root):
+            if entry.name.endswith((".arrow", ".tmp")) and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
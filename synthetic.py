@@ -0,0 +1,358 @@
+import argparse
+import io
+import logging
+import math
+import shutil
+import subprocess
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import text
+
+import rollups
+from db import database_url
+from migrate import migrate
+from offline import DEFAULT_SOURCE, TABLES
+
+logger = logging.getLogger(__name__)
+
+# Rows generated and copied per batch
+CHUNK = 250_000
+
+# Same value distributions as the demo dump
+CATEGORIES = {
+    "Apparel": 412, "Footwear": 183, "Watches & Jewelry": 88, "Luggage": 82, "Sportswear": 70,
+    "Accessories": 57, "Cosmetics": 56, "Formal Wear": 41, "Traditional": 11,
+}
+GENDERS = ["male", "female", "unisex"]
+# Order of the size rows: webshop.sizes ids 1-5 are female, 6-10 male, 11-15 unisex
+SIZE_GENDERS = ["female", "male", "unisex"]
+SIZE_NAMES = ["XS", "S", "M", "L", "XL"]
+US_SIZES = ["[2,4)", "[4,6)", "[6,8)", "[8,10)", "[10,12)"]
+UK_SIZES = ["[4,6)", "[6,10)", "[10,14)", "[14,18)", "[18,22)"]
+EU_SIZES = ["[32,36)", "[36,40)", "[40,44)", "[44,46)", "[46,50)"]
+FIRST_NAMES = {
+    "male": ["Liam", "Noah", "Elias", "Luca", "Jonas", "Felix", "Leon", "Paul", "Ben", "Finn"],
+    "female": ["Emma", "Mia", "Sofia", "Lena", "Vera", "Emilia", "Hanna", "Lea", "Anna", "Marie"],
+}
+LAST_NAMES = ["Horton", "Halonen", "Meier", "Roux", "Berg", "Novak", "Costa", "Weber", "Blanc", "Dahl"]
+COLORS = 143
+CITIES = 750
+FIRST_ORDER = pd.Timestamp("2016-08-03", tz="UTC")
+LAST_ORDER = pd.Timestamp("2018-08-02", tz="UTC")
+GENERATED_AT = pd.Timestamp("2018-08-02 12:00", tz="UTC")
+
+# Every table and batch draws from its own stream, so a seed and scale always
+# give the same data
+_STREAMS = {table: number for number, table in enumerate(TABLES)}
+
+
+def parse_scale(value):
+    # "10k", "2.5M" or a plain number of order lines
+    value = str(value).strip()
+    factor = {"k": 10**3, "m": 10**6}.get(value[-1:].lower(), 1)
+    return int(float(value[:-1] if factor > 1 else value) * factor)
+
+
+class Scale:
+    # Table sizes for a number of order lines, grown from the demo's
+    # proportions: ~3 lines an order, ~2 orders a customer, and a catalogue
+    # that grows with the square root of the sales
+    def __init__(self, order_lines):
+        self.order_lines = order_lines
+        self.orders = max(1, order_lines // 3)
+        self.customers = max(1000, self.orders // 2)
+        self.products = max(1000, int(13 * math.sqrt(order_lines)))
+        self.labels = self.products * 117 // 100
+
+    def __repr__(self):
+        return (
+            f"{self.order_lines} order lines, {self.orders} orders, "
+            f"{self.customers} customers, {self.products} products"
+        )
+
+
+def rng(seed, table, batch=0):
+    return np.random.default_rng([seed, _STREAMS[table], batch])
+
+
+def batches(total):
+    for batch, start in enumerate(range(0, total, CHUNK)):
+        yield batch, start, min(CHUNK, total - start)
+
+
+def copy(cursor, table, frame):
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ", ".join(f'"{column}"' for column in frame.columns)
+    cursor.copy_expert(f'COPY webshop."{table}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def colors(seed):
+    r = rng(seed, "colors")
+    rgb = r.integers(0, 2**24, COLORS)
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, COLORS + 1),
+            "name": [f"COLOR{i}" for i in range(1, COLORS + 1)],
+            "rgb": [f"#{value:06X}" for value in rgb],
+        }
+    )
+
+
+def labels(scale):
+    ids = np.arange(1, scale.labels + 1)
+    return pd.DataFrame(
+        {"id": ids, "name": [f"Label {i}" for i in ids], "slugname": [f"Label{i}" for i in ids]}
+    )
+
+
+def sizes():
+    rows = [
+        (gender, category, name, us, uk, eu)
+        for gender, category in zip(SIZE_GENDERS, ["Apparel", "Apparel", "Footwear"])
+        for name, us, uk, eu in zip(SIZE_NAMES, US_SIZES, UK_SIZES, EU_SIZES)
+    ]
+    frame = pd.DataFrame(rows, columns=["gender", "category", "size", "size_us", "size_uk", "size_eu"])
+    frame.insert(0, "id", np.arange(1, len(frame) + 1))
+    return frame
+
+
+def products(seed, scale):
+    r = rng(seed, "products")
+    weights = np.array(list(CATEGORIES.values()), dtype=float)
+    ids = np.arange(1, scale.products + 1)
+    category = r.choice(list(CATEGORIES), scale.products, p=weights / weights.sum())
+    return pd.DataFrame(
+        {
+            "id": ids,
+            "name": [f"{c} {i}" for c, i in zip(category, ids)],
+            "labelid": r.integers(1, scale.labels + 1, scale.products),
+            "category": category,
+            "gender": r.choice(GENDERS, scale.products),
+            "currentlyactive": True,
+            "created": GENERATED_AT,
+        }
+    )
+
+
+def articles(seed, product_frame):
+    # Every product comes in 1-6 colors, each in the 5 sizes of its gender
+    r = rng(seed, "articles")
+    n_colors = r.integers(1, 7, len(product_frame))
+    per_product = n_colors * len(SIZE_NAMES)
+    product = np.repeat(np.arange(len(product_frame)), per_product)
+    color = np.repeat(r.integers(1, COLORS + 1, n_colors.sum()), len(SIZE_NAMES))
+    size_offset = np.array([SIZE_GENDERS.index(g) for g in product_frame["gender"]]) * len(SIZE_NAMES)
+    size = np.tile(np.arange(1, len(SIZE_NAMES) + 1), n_colors.sum()) + size_offset.repeat(per_product)
+
+    # Prices are set per product; about half of the products are discounted
+    original = np.round(r.uniform(51, 151, len(product_frame)))
+    discount = np.where(r.random(len(product_frame)) < 0.5, r.integers(5, 45, len(product_frame)), 0)
+    reduced = np.where(discount > 0, np.round(original * (100 - discount) / 100, 2), np.nan)
+    names = product_frame["name"].to_numpy()[product]
+
+    count = len(product)
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, count + 1),
+            "productid": product_frame["id"].to_numpy()[product],
+            "ean": r.integers(10**6, 10**8, count).astype(str),
+            "colorid": color,
+            "size": size,
+            "description": [f"The stylish {name} is just what you need right now!" for name in names],
+            "originalprice": original[product],
+            "reducedprice": reduced[product],
+            "taxrate": 19.0,
+            "discountinpercent": discount[product],
+            "currentlyactive": True,
+            "created": GENERATED_AT,
+        }
+    )
+
+
+def stock(seed, article_frame, batch):
+    r = rng(seed, "stock", batch)
+    return pd.DataFrame(
+        {
+            "id": article_frame["id"],
+            "articleid": article_frame["id"],
+            "count": r.integers(0, 10, len(article_frame)),
+            "created": GENERATED_AT,
+        }
+    )
+
+
+def customers(seed, scale):
+    # (customer, address) batches; every customer has one address
+    for batch, start, size in batches(scale.customers):
+        r = rng(seed, "customer", batch)
+        ids = np.arange(start + 1, start + size + 1)
+        gender = r.choice(["male", "female"], size)
+        first = np.where(
+            gender == "male",
+            np.array(FIRST_NAMES["male"])[r.integers(0, 10, size)],
+            np.array(FIRST_NAMES["female"])[r.integers(0, 10, size)],
+        )
+        last = np.array(LAST_NAMES)[r.integers(0, len(LAST_NAMES), size)]
+        birth = pd.Timestamp("1940-01-01") + pd.to_timedelta(r.integers(0, 60 * 365, size), unit="D")
+        customer = pd.DataFrame(
+            {
+                "id": ids,
+                "firstname": first,
+                "lastname": last,
+                "gender": gender,
+                "email": [f"{f.lower()}.{l.lower()}{i}@example.com" for f, l, i in zip(first, last, ids)],
+                "dateofbirth": birth.date,
+                "currentaddressid": ids,
+                "created": GENERATED_AT,
+            }
+        )
+        r = rng(seed, "address", batch)
+        # Cities are skewed: a few big ones and a long tail
+        city = (CITIES * r.random(size) ** 2).astype(int) + 1
+        address = pd.DataFrame(
+            {
+                "id": ids,
+                "customerid": ids,
+                "address1": [f"{n} Main Street" for n in r.integers(1, 10000, size)],
+                "city": [f"City {c}" for c in city],
+                "zip": r.integers(1000, 10000, size).astype(str),
+                "created": GENERATED_AT,
+            }
+        )
+        yield customer, address
+
+
+def orders(seed, scale, article_frame):
+    # (order, order_positions) batches adding up to exactly scale.order_lines
+    # lines; a minority of customers and articles get most of the orders
+    price = article_frame["reducedprice"].fillna(article_frame["originalprice"]).to_numpy()
+    span = (LAST_ORDER - FIRST_ORDER).total_seconds()
+    next_order, next_line = 1, 1
+    batch = 0
+    while next_line <= scale.order_lines:
+        r = rng(seed, "order", batch)
+        lines_per_order = r.integers(1, 6, CHUNK)
+        ends = np.cumsum(lines_per_order)
+        remaining = scale.order_lines - next_line + 1
+        n_orders = int(np.searchsorted(ends, remaining)) + 1
+        n_orders = min(n_orders, CHUNK)
+        lines_per_order = lines_per_order[:n_orders]
+        lines_per_order[-1] -= max(0, int(ends[n_orders - 1]) - remaining)
+
+        order_ids = np.arange(next_order, next_order + n_orders)
+        customer = (scale.customers * r.random(n_orders) ** 2).astype(int) + 1
+        # Orders are appended over time, so ids and timestamps grow together
+        progress = np.clip((order_ids - r.random(n_orders)) / scale.orders, 0, 1)
+        placed = FIRST_ORDER + pd.to_timedelta(progress * span, unit="s")
+
+        n_lines = int(lines_per_order.sum())
+        article = (len(article_frame) * r.random(n_lines) ** 1.5).astype(int)
+        line_order = np.repeat(order_ids, lines_per_order)
+        line_price = price[article]
+        positions = pd.DataFrame(
+            {
+                "id": np.arange(next_line, next_line + n_lines),
+                "orderid": line_order,
+                "articleid": article + 1,
+                "amount": 1,
+                "price": line_price,
+                "created": np.repeat(placed, lines_per_order),
+            }
+        )
+        total = np.bincount(line_order - next_order, weights=line_price, minlength=n_orders)
+        order = pd.DataFrame(
+            {
+                "id": order_ids,
+                "customer": customer,
+                "ordertimestamp": placed,
+                "shippingaddressid": customer,
+                "total": np.round(total, 2),
+                "shippingcost": 3.90,
+                "created": placed,
+            }
+        )
+        yield order, positions
+        next_order += n_orders
+        next_line += n_lines
+        batch += 1
+
+
+def ensure_schema(engine, dump=DEFAULT_SOURCE):
+    # Restores the webshop schema (no data) from the demo dump if it is missing
+    with engine.connect() as connection:
+        exists = connection.execute(text("SELECT to_regclass('webshop.order_positions')")).scalar()
+    if exists:
+        return
+    pg_restore = shutil.which("pg_restore")
+    if pg_restore is None:
+        raise RuntimeError("pg_restore is needed to create the webshop schema from the dump")
+    url = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    subprocess.run(
+        [pg_restore, "--schema-only", "--no-owner", "--no-privileges", f"--dbname={url}", dump],
+        check=False,
+    )
+
+
+def generate(engine, order_lines, seed=0, replace=False):
+    scale = Scale(order_lines)
+    ensure_schema(engine)
+    with engine.begin() as connection:
+        connection.execute(text(rollups.DDL))
+        if connection.execute(text("SELECT EXISTS (SELECT 1 FROM webshop.order_positions)")).scalar():
+            if not replace:
+                raise RuntimeError("webshop already holds data; pass --replace to overwrite it")
+        tables = [f'webshop."{table}"' for table in TABLES] + list(rollups.ROLLUPS)
+        connection.execute(text(f"TRUNCATE {', '.join(tables)}, webshop.rollup_watermark"))
+
+    logger.info("generating %r", scale)
+    product_frame = products(seed, scale)
+    article_frame = articles(seed, product_frame)
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        copy(cursor, "colors", colors(seed))
+        copy(cursor, "labels", labels(scale))
+        copy(cursor, "sizes", sizes())
+        copy(cursor, "products", product_frame)
+        for batch, start, size in batches(len(article_frame)):
+            copy(cursor, "articles", article_frame.iloc[start : start + size])
+            copy(cursor, "stock", stock(seed, article_frame.iloc[start : start + size], batch))
+        for customer, address in customers(seed, scale):
+            copy(cursor, "address", address)
+            copy(cursor, "customer", customer)
+        for order, positions in orders(seed, scale, article_frame):
+            copy(cursor, "order", order)
+            copy(cursor, "order_positions", positions)
+            logger.info("%d order lines written", positions["id"].iloc[-1])
+        for table in TABLES:
+            cursor.execute(
+                f"""SELECT setval(pg_get_serial_sequence('webshop."{table}"', 'id'),
+                    (SELECT COALESCE(MAX(id), 0) + 1 FROM webshop."{table}"), false)"""
+            )
+        raw.commit()
+    finally:
+        raw.close()
+
+    migrate(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("ANALYZE"))
+    rollups.refresh(engine, full=True)
+    return scale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill the webshop schema with deterministic synthetic data"
+    )
+    parser.add_argument("order_lines", help="number of order lines, e.g. 10k, 1M or 50M")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replace", action="store_true", help="delete the data already in webshop")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generate(sqlalchemy.create_engine(database_url()), parse_scale(args.order_lines), args.seed, args.replace)
@@ -0,0 +1,40 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from cache import ResultCache
+
+
+def test_concurrent_misses_compute_once_and_release_the_key_lock():
+    cache = ResultCache(max_bytes=10**6)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return pd.DataFrame({"n": [1, 2, 3]})
+
+    threads = [
+        threading.Thread(target=cache.get_or_compute, args=("key", "fetch", (), "sales", compute))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert cache._key_locks == {}
+
+
+def test_failed_compute_releases_the_key_lock():
+    cache = ResultCache(max_bytes=10**6)
+
+    def compute():
+        raise RuntimeError("database went away")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("key", "fetch", (), "sales", compute)
+    assert cache._key_locks == {}
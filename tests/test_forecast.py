@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from forecast import smoothed_demand
+
+N_WEEKS = 6
+
+# (series, weeks before the last week, amount): series 0 has uneven gaps and
+# two rows for one week, series 1 a single week, series 2 only the last week,
+# series 3 no sales at all
+ROWS = [
+    (0, 5, 4.0),
+    (0, 3, 1.0),
+    (0, 3, 2.0),
+    (0, 0, 6.0),
+    (1, 2, 5.0),
+    (2, 0, 3.0),
+]
+N_SERIES = 4
+
+
+def recursive_demand(alpha):
+    # The textbook recursion over every week, oldest first, starting from
+    # the series' mean week
+    weekly = np.zeros((N_SERIES, N_WEEKS))
+    for series, weeks_ago, amount in ROWS:
+        weekly[series, N_WEEKS - 1 - weeks_ago] += amount
+    levels = []
+    for demand in weekly:
+        level = demand.mean()
+        for week in demand:
+            level = alpha * week + (1 - alpha) * level
+        levels.append(level)
+    return np.array(levels)
+
+
+@pytest.mark.parametrize("alpha", [0.0, 0.2, 0.5, 1.0])
+def test_smoothed_demand_matches_the_recursion(alpha):
+    series, weeks_ago, amounts = (np.array(column) for column in zip(*ROWS))
+    levels = smoothed_demand(series, weeks_ago, amounts, N_SERIES, N_WEEKS, alpha=alpha)
+    np.testing.assert_allclose(levels, recursive_demand(alpha))
@@ -0,0 +1,54 @@
+import pandas as pd
+
+from queries import classify_price_reductions
+
+START = pd.Timestamp("2018-01-01")
+END = pd.Timestamp("2018-01-11")
+
+
+def daily_series(rows, products):
+    # rows: (product, day offset, full-price sales, discounted sales)
+    df = pd.DataFrame(rows, columns=["product", "day", "full_price_sales", "discounted_sales"])
+    df["product"] = pd.Categorical(df["product"], categories=products)
+    df["day"] = START + pd.to_timedelta(df["day"], unit="D")
+    return df.set_index(["product", "day"])
+
+
+def effects(rows, products):
+    df = classify_price_reductions(daily_series(rows, products), START, END)
+    return dict(zip(df["product"].astype(str), df["effect"].astype(str)))
+
+
+def test_products_sold_both_ways_are_compared_before_and_after():
+    assert effects(
+        [
+            # One full-price sale in 5 days, then 5 sales in 5 days
+            ("gained", 0, 1, 0),
+            ("gained", 5, 2, 3),
+            # Five full-price sales in 5 days, then one sale in 5 days
+            ("lost", 1, 5, 0),
+            ("lost", 5, 0, 1),
+        ],
+        ["gained", "lost"],
+    ) == {"gained": "benefited", "lost": "no gain"}
+
+
+def test_full_price_sales_only_after_the_reduction_have_no_baseline():
+    assert effects(
+        [
+            # Discounted on a later day, full price only from then on
+            ("later", 3, 0, 1),
+            ("later", 6, 2, 0),
+            # Discounted on the first day of the series
+            ("first day", 0, 0, 1),
+            ("first day", 4, 1, 0),
+        ],
+        ["later", "first day"],
+    ) == {"later": "no full-price baseline", "first day": "no full-price baseline"}
+
+
+def test_products_sold_one_way_or_not_at_all():
+    assert effects(
+        [("discounted", 2, 0, 3), ("full price", 2, 4, 0)],
+        ["discounted", "full price", "unsold"],
+    ) == {"discounted": "discount only", "full price": "full price only", "unsold": "unsold"}